@@ -1,20 +1,32 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import asyncio
 import json
 import logging
 from langsmith import traceable
-from .models import Message, HealthData, NutritionData
+from .models import Message, MessageType, HealthData, NutritionData
 from .llm_service import LLMService
 from .file_service import FileService
+from .router import is_greeting
 
 logger = logging.getLogger(__name__)
 
 class BaseAgent(ABC):
+    # Snapshot and append-only journal backing the agent's user data
+    DATA_FILE: Optional[str] = None
+    JOURNAL_FILE: Optional[str] = None
+    
+    # Conversations whose formatted history is kept for incremental rebuilds
+    HISTORY_CACHE_SIZE = 256
+    
     def __init__(self, name: str, system_prompt: str, file_service: FileService, llm_service: LLMService):
         self.name = name
         self.system_prompt = system_prompt
         self.file_service = file_service
         self.llm_service = llm_service
+        self._compactions: Dict[str, asyncio.Task] = {}
+        self._history_cache: "OrderedDict[int, Tuple[Message, List[Dict[str, str]]]]" = OrderedDict()
         self.tools = self._register_tools()
     
     @abstractmethod
@@ -26,21 +38,20 @@ class BaseAgent(ABC):
     async def process_message(self, user_id: str, message: str, conversation_history: List[Message]) -> str:
         """Process a message and return response with LangSmith tracing"""
         try:
-            # Build conversation context
-            context = self._build_context(conversation_history)
+            # Prior turns go first as a stable prefix so provider-side prompt caching can reuse it
+            messages = self._build_messages(conversation_history, message)
             
             # Get LLM response with tracing
             response = await self.llm_service.get_completion(
-                messages=[
-                    {"role": "user", "content": f"Context: {context}\n\nUser message: {message}"}
-                ],
+                messages=messages,
                 system_prompt=self.system_prompt,
                 temperature=0.7,
-                run_name=f"{self.name.lower()}_agent_response"
+                run_name=f"{self.name.lower()}_agent_response",
+                prompt_cache_key=user_id
             )
             
-            # Log interaction
-            await self.file_service.log_to_file(
+            # Log interaction; the write happens in the background so the reply isn't held up
+            self.file_service.log_nowait(
                 user_id, 
                 f"{self.name.lower()}_interactions.md",
                 f"User: {message}\n{self.name}: {response}"
@@ -52,24 +63,117 @@ class BaseAgent(ABC):
             logger.error(f"Error in {self.name} agent: {e}")
             return f"I apologize, but I encountered an error while processing your request. Please try again."
     
-    def _build_context(self, conversation_history: List[Message], max_messages: int = 10) -> str:
-        """Build conversation context from history"""
+    def _build_messages(
+        self,
+        conversation_history: List[Message],
+        message: str,
+        max_messages: int = 10
+    ) -> List[Dict[str, str]]:
+        """Build chat messages from recent history followed by the current user message"""
+        history_messages = self._history_messages(conversation_history, max_messages + 1)
+        
+        # Callers usually append the current message to the history before dispatching
+        if conversation_history:
+            last = conversation_history[-1]
+            if last.message_type != MessageType.AGENT and last.content == message:
+                history_messages = history_messages[:-1]
+        
+        messages = history_messages[-max_messages:]
+        messages.append({"role": "user", "content": message})
+        return messages
+    
+    def _history_messages(self, conversation_history: List[Message], window: int) -> List[Dict[str, str]]:
+        """Chat messages for the last `window` history entries, extended incrementally across turns"""
         if not conversation_history:
-            return "No previous conversation."
+            return []
+        
+        key = id(conversation_history)
+        last = conversation_history[-1]
+        cached = self._history_cache.get(key)
         
-        recent_messages = conversation_history[-max_messages:]
-        context_lines = []
+        if cached is not None and cached[0] is last:
+            formatted = cached[1]
+        else:
+            formatted = None
+            if cached is not None:
+                # Locate the entry the cached window ended on and convert only what came after it
+                length = len(conversation_history)
+                for back in range(2, min(length, window) + 1):
+                    if conversation_history[-back] is cached[0]:
+                        new_messages = [self._to_chat_message(msg) for msg in conversation_history[length - back + 1:]]
+                        formatted = (cached[1] + new_messages)[-window:]
+                        break
+            
+            if formatted is None:
+                formatted = [self._to_chat_message(msg) for msg in conversation_history[-window:]]
+            
+            self._history_cache[key] = (last, formatted)
         
-        for msg in recent_messages:
-            context_lines.append(f"{msg.sender}: {msg.content}")
+        self._history_cache.move_to_end(key)
+        while len(self._history_cache) > self.HISTORY_CACHE_SIZE:
+            self._history_cache.popitem(last=False)
         
-        return "\n".join(context_lines)
+        return formatted
+    
+    def _to_chat_message(self, msg: Message) -> Dict[str, str]:
+        """Convert a conversation history entry to a chat completion message"""
+        if msg.message_type == MessageType.AGENT:
+            return {"role": "assistant", "content": msg.content}
+        if msg.message_type == MessageType.EXTERNAL:
+            return {"role": "user", "content": f"{msg.sender}: {msg.content}"}
+        return {"role": "user", "content": msg.content}
+    
+    def _empty_data(self) -> Dict[str, Any]:
+        """Initial user data before any event is recorded"""
+        return {}
+    
+    def _apply_event(self, data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        """Apply a journaled event to user data in place"""
+        pass
+    
+    def _replay(self, snapshot: Optional[Dict[str, Any]], events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Rebuild user data from a snapshot and the events journaled since"""
+        data = snapshot or self._empty_data()
+        for event in events:
+            self._apply_event(data, event)
+        return data
+    
+    async def _load_data(self, user_id: str) -> Dict[str, Any]:
+        """Load user data, from the live cached state when present, else by replaying the journal over the snapshot"""
+        data = self.file_service.peek_json(user_id, self.JOURNAL_FILE)
+        if data is None:
+            data = await self.file_service.load_journaled(user_id, self.JOURNAL_FILE, self.DATA_FILE, self._replay)
+        return data
+    
+    async def _record_event(self, user_id: str, event: str, payload: Any) -> bool:
+        """Append an event to the user's journal, compacting it in the background once it grows"""
+        record = {"event": event, "data": payload}
+        if not await self.file_service.append_jsonl(user_id, self.JOURNAL_FILE, record):
+            return False
+        
+        # Keep the live cached state in step with the journal so the next read needs no disk access
+        data = self.file_service.peek_json(user_id, self.JOURNAL_FILE)
+        if data is not None:
+            self._apply_event(data, record)
+        
+        # At most one compaction per user in flight; events arriving meanwhile are merged by the next one
+        journal_size = self.file_service.journal_size(user_id, self.JOURNAL_FILE)
+        if journal_size > self.file_service.journal_compact_bytes and user_id not in self._compactions:
+            task = asyncio.create_task(
+                self.file_service.compact_jsonl(user_id, self.JOURNAL_FILE, self.DATA_FILE, self._replay)
+            )
+            self._compactions[user_id] = task
+            task.add_done_callback(lambda _: self._compactions.pop(user_id, None))
+        
+        return True
 
 class HeliosAgent(BaseAgent):
     """Fitness and exercise agent"""
     
-    def __init__(self, file_service: FileService, llm_service: LLMService):
-        system_prompt = """You are Helios 💪, a fitness and exercise expert agent. You help users with:
+    DATA_FILE = "helios_data.json"
+    JOURNAL_FILE = "helios_data.jsonl"
+    
+    SYSTEM_PROMPT = """You are Helios 💪, a fitness and exercise expert agent. You help users with:
 
         🏋️ Workout planning and routines
         🏃 Exercise recommendations
@@ -89,8 +193,9 @@ class HeliosAgent(BaseAgent):
         Always ask about current fitness level, any injuries, and specific goals before giving detailed advice.
         Keep responses practical and actionable.
         """
-        
-        super().__init__("Helios", system_prompt, file_service, llm_service)
+    
+    def __init__(self, file_service: FileService, llm_service: LLMService):
+        super().__init__("Helios", self.SYSTEM_PROMPT, file_service, llm_service)
     
     def _register_tools(self) -> Dict[str, callable]:
         return {
@@ -100,19 +205,24 @@ class HeliosAgent(BaseAgent):
             "get_user_fitness_data": self.get_user_fitness_data
         }
     
+    def _empty_data(self) -> Dict[str, Any]:
+        return {"workouts": [], "goals": [], "preferences": {}}
+    
+    def _apply_event(self, data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        if event["event"] == "workout":
+            data["workouts"].append(event["data"])
+        elif event["event"] == "goal":
+            data["goals"].append(event["data"])
+    
     @traceable(name="save_workout_tool")
     async def save_workout(self, user_id: str, workout_data: Dict[str, Any]) -> str:
         """Save workout data for user with tracing"""
         try:
-            existing_data = await self.file_service.load_json(user_id, "helios_data.json")
-            if not existing_data:
-                existing_data = {"workouts": [], "goals": [], "preferences": {}}
-            
             workout_data["timestamp"] = workout_data.get("timestamp", "now")
-            existing_data["workouts"].append(workout_data)
+            await self._record_event(user_id, "workout", workout_data)
             
-            await self.file_service.save_json(user_id, "helios_data.json", existing_data)
-            return f"💪 Workout saved! You've logged {len(existing_data['workouts'])} workouts total."
+            data = await self._load_data(user_id)
+            return f"💪 Workout saved! You've logged {len(data['workouts'])} workouts total."
             
         except Exception as e:
             return f"Error saving workout: {str(e)}"
@@ -121,19 +231,19 @@ class HeliosAgent(BaseAgent):
     async def get_workout_history(self, user_id: str) -> str:
         """Get user's workout history with tracing"""
         try:
-            data = await self.file_service.load_json(user_id, "helios_data.json")
-            if not data or not data.get("workouts"):
+            data = await self._load_data(user_id)
+            if not data.get("workouts"):
                 return "No workout history found. Let's start tracking your fitness journey! 🏃‍♀️"
             
             recent_workouts = data["workouts"][-5:]  # Last 5 workouts
-            summary = f"📈 Your recent workouts ({len(data['workouts'])} total):\n"
+            parts = [f"📈 Your recent workouts ({len(data['workouts'])} total):"]
             
             for i, workout in enumerate(recent_workouts, 1):
                 workout_type = workout.get("type", "Workout")
                 duration = workout.get("duration", "Unknown duration")
-                summary += f"{i}. {workout_type} - {duration}\n"
+                parts.append(f"{i}. {workout_type} - {duration}")
             
-            return summary
+            return "\n".join(parts) + "\n"
             
         except Exception as e:
             return f"Error retrieving workout history: {str(e)}"
@@ -142,17 +252,11 @@ class HeliosAgent(BaseAgent):
     async def set_fitness_goal(self, user_id: str, goal: str) -> str:
         """Set fitness goal for user with tracing"""
         try:
-            existing_data = await self.file_service.load_json(user_id, "helios_data.json")
-            if not existing_data:
-                existing_data = {"workouts": [], "goals": [], "preferences": {}}
-            
-            existing_data["goals"].append({
+            await self._record_event(user_id, "goal", {
                 "goal": goal,
                 "set_date": "now",
                 "status": "active"
             })
-            
-            await self.file_service.save_json(user_id, "helios_data.json", existing_data)
             return f"🎯 Goal set: {goal}. Let's crush it together! 💪"
             
         except Exception as e:
@@ -160,14 +264,15 @@ class HeliosAgent(BaseAgent):
     
     async def get_user_fitness_data(self, user_id: str) -> Dict[str, Any]:
         """Get all fitness data for user"""
-        data = await self.file_service.load_json(user_id, "helios_data.json")
-        return data or {"workouts": [], "goals": [], "preferences": {}}
+        return await self._load_data(user_id)
 
 class CeresAgent(BaseAgent):
     """Nutrition and food agent"""
     
-    def __init__(self, file_service: FileService, llm_service: LLMService):
-        system_prompt = """You are Ceres 🥗, a nutrition and food expert agent. You help users with:
+    DATA_FILE = "ceres_data.json"
+    JOURNAL_FILE = "ceres_data.jsonl"
+    
+    SYSTEM_PROMPT = """You are Ceres 🥗, a nutrition and food expert agent. You help users with:
 
         🍽️ Meal planning and recipes
         🥬 Nutritional advice and education
@@ -187,8 +292,9 @@ class CeresAgent(BaseAgent):
         Always ask about dietary restrictions, allergies, and health goals before making recommendations.
         Provide balanced, sustainable nutrition advice.
         """
-        
-        super().__init__("Ceres", system_prompt, file_service, llm_service)
+    
+    def __init__(self, file_service: FileService, llm_service: LLMService):
+        super().__init__("Ceres", self.SYSTEM_PROMPT, file_service, llm_service)
     
     def _register_tools(self) -> Dict[str, callable]:
         return {
@@ -198,18 +304,24 @@ class CeresAgent(BaseAgent):
             "get_user_nutrition_data": self.get_user_nutrition_data
         }
     
+    def _empty_data(self) -> Dict[str, Any]:
+        return {"meals": [], "dietary_preferences": [], "allergies": [], "nutrition_goals": {}}
+    
+    def _apply_event(self, data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        if event["event"] == "meal":
+            data["meals"].append(event["data"])
+        elif event["event"] == "dietary_preference":
+            if event["data"] not in data["dietary_preferences"]:
+                data["dietary_preferences"].append(event["data"])
+    
     async def save_meal(self, user_id: str, meal_data: Dict[str, Any]) -> str:
         """Save meal data for user"""
         try:
-            existing_data = await self.file_service.load_json(user_id, "ceres_data.json")
-            if not existing_data:
-                existing_data = {"meals": [], "dietary_preferences": [], "allergies": [], "nutrition_goals": {}}
-            
             meal_data["timestamp"] = meal_data.get("timestamp", "now")
-            existing_data["meals"].append(meal_data)
+            await self._record_event(user_id, "meal", meal_data)
             
-            await self.file_service.save_json(user_id, "ceres_data.json", existing_data)
-            return f"🍽️ Meal logged! You've tracked {len(existing_data['meals'])} meals total."
+            data = await self._load_data(user_id)
+            return f"🍽️ Meal logged! You've tracked {len(data['meals'])} meals total."
             
         except Exception as e:
             return f"Error saving meal: {str(e)}"
@@ -217,19 +329,19 @@ class CeresAgent(BaseAgent):
     async def get_meal_history(self, user_id: str) -> str:
         """Get user's meal history"""
         try:
-            data = await self.file_service.load_json(user_id, "ceres_data.json")
-            if not data or not data.get("meals"):
+            data = await self._load_data(user_id)
+            if not data.get("meals"):
                 return "No meal history found. Let's start tracking your nutrition journey! 🌱"
             
             recent_meals = data["meals"][-5:]  # Last 5 meals
-            summary = f"📊 Your recent meals ({len(data['meals'])} total):\n"
+            parts = [f"📊 Your recent meals ({len(data['meals'])} total):"]
             
             for i, meal in enumerate(recent_meals, 1):
                 meal_name = meal.get("name", "Meal")
                 meal_type = meal.get("type", "Snack")
-                summary += f"{i}. {meal_name} ({meal_type})\n"
+                parts.append(f"{i}. {meal_name} ({meal_type})")
             
-            return summary
+            return "\n".join(parts) + "\n"
             
         except Exception as e:
             return f"Error retrieving meal history: {str(e)}"
@@ -238,14 +350,7 @@ class CeresAgent(BaseAgent):
     async def set_dietary_preference(self, user_id: str, preference: str) -> str:
         """Set dietary preference for user with tracing"""
         try:
-            existing_data = await self.file_service.load_json(user_id, "ceres_data.json")
-            if not existing_data:
-                existing_data = {"meals": [], "dietary_preferences": [], "allergies": [], "nutrition_goals": {}}
-            
-            if preference not in existing_data["dietary_preferences"]:
-                existing_data["dietary_preferences"].append(preference)
-            
-            await self.file_service.save_json(user_id, "ceres_data.json", existing_data)
+            await self._record_event(user_id, "dietary_preference", preference)
             return f"🌱 Dietary preference added: {preference}. I'll keep this in mind for future recommendations!"
             
         except Exception as e:
@@ -254,14 +359,12 @@ class CeresAgent(BaseAgent):
     @traceable(name="get_user_nutrition_data_tool")
     async def get_user_nutrition_data(self, user_id: str) -> Dict[str, Any]:
         """Get all nutrition data for user with tracing"""
-        data = await self.file_service.load_json(user_id, "ceres_data.json")
-        return data or {"meals": [], "dietary_preferences": [], "allergies": [], "nutrition_goals": {}}
+        return await self._load_data(user_id)
 
 class GeneralAgent(BaseAgent):
     """General purpose assistant agent"""
     
-    def __init__(self, file_service: FileService, llm_service: LLMService):
-        system_prompt = """You are a General Assistant 🤖, a helpful and friendly AI agent. You help with:
+    SYSTEM_PROMPT = """You are a General Assistant 🤖, a helpful and friendly AI agent. You help with:
 
         💬 General conversation and questions
         📚 Information and explanations
@@ -280,8 +383,17 @@ class GeneralAgent(BaseAgent):
         When users ask about fitness, direct them to Helios 💪
         When users ask about nutrition, direct them to Ceres 🥗
         """
-        
-        super().__init__("General Assistant", system_prompt, file_service, llm_service)
+    
+    # Canned replies for greetings and acknowledgements that skip routing and the LLM
+    GREETING_REPLY = "👋 Hi! I can help with fitness (Helios 💪) or nutrition (Ceres 🥗) — what's on your mind?"
+    ACKNOWLEDGEMENT_REPLY = "✨ Anytime! Let me know if there's anything else about fitness or nutrition I can help with."
+    
+    def __init__(self, file_service: FileService, llm_service: LLMService):
+        super().__init__("General Assistant", self.SYSTEM_PROMPT, file_service, llm_service)
+    
+    def quick_reply(self, message: str) -> str:
+        """Canned reply for a low-entropy message (see router.is_low_entropy)"""
+        return self.GREETING_REPLY if is_greeting(message) else self.ACKNOWLEDGEMENT_REPLY
     
     def _register_tools(self) -> Dict[str, callable]:
         return {
@@ -303,14 +415,11 @@ class GeneralAgent(BaseAgent):
     async def get_notes(self, user_id: str) -> str:
         """Get user's notes with tracing"""
         try:
-            notes = await self.file_service.read_file(user_id, "notes.md")
-            if not notes:
+            # Only the last few lines are read from disk
+            recent_notes = await self.file_service.tail_lines(user_id, "notes.md", 5)
+            if not recent_notes:
                 return "📝 No notes found. Feel free to ask me to save something for you!"
             
-            # Return last few lines
-            lines = notes.strip().split('\n')
-            recent_notes = lines[-5:] if len(lines) > 5 else lines
-            
             return f"📚 Your recent notes:\n" + "\n".join(recent_notes)
             
         except Exception as e:
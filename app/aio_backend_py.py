@@ -0,0 +1,107 @@
+"""
+Async File I/O Backend
+Runs each file operation as a single blocking call on a dedicated thread pool
+"""
+
+import asyncio
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+# One hop per operation: open, read/write and close all happen in the same worker call
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="file-io")
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _write_bytes(path: str, data: bytes, atomic: bool) -> None:
+    target = f"{path}.tmp" if atomic else path
+    with open(target, 'wb') as f:
+        f.write(data)
+    if atomic:
+        os.replace(target, path)
+
+
+def _append_bytes(path: str, data: bytes) -> int:
+    with open(path, 'ab') as f:
+        f.write(data)
+        return f.tell()
+
+
+def _writev(fd: int, buffers: List[bytes]) -> None:
+    written = os.writev(fd, buffers)
+    total = sum(len(buffer) for buffer in buffers)
+    if written < total:
+        # Short write: fall back to plain writes for whatever is left
+        remaining = memoryview(b"".join(buffers))[written:]
+        while remaining:
+            remaining = remaining[os.write(fd, remaining):]
+
+
+def _tail_lines(path: str, n: int) -> List[str]:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm)
+            while end > 0 and mm[end - 1] in b" \t\r\n":
+                end -= 1
+            
+            # Walk back over the last n line breaks; only those pages get faulted in
+            start = end
+            for _ in range(n):
+                start = mm.rfind(b"\n", 0, start)
+                if start == -1:
+                    break
+            
+            tail = mm[start + 1:end].decode('utf-8', 'replace')
+    return tail.split("\n") if tail.strip() else []
+
+
+def _list_files(path: str) -> List[str]:
+    try:
+        with os.scandir(path) as entries:
+            # DirEntry.is_file() uses the type from the directory listing, so no per-file stat
+            return [entry.name for entry in entries if entry.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+async def run(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking file operation on the I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def read_bytes(path: str) -> bytes:
+    """Read a whole file"""
+    return await run(_read_bytes, path)
+
+
+async def write_bytes(path: str, data: bytes, atomic: bool = False) -> None:
+    """Replace a file's content, optionally via a temp file and rename"""
+    await run(_write_bytes, path, data, atomic)
+
+
+async def append_bytes(path: str, data: bytes) -> int:
+    """Append to a file, creating it if needed; returns the file's new size"""
+    return await run(_append_bytes, path, data)
+
+
+async def tail_lines(path: str, n: int) -> List[str]:
+    """Read the last n lines of a file without loading the whole file"""
+    return await run(_tail_lines, path, n)
+
+
+async def writev(fd: int, buffers: List[bytes]) -> None:
+    """Write several buffers to an open file descriptor with a single syscall"""
+    await run(_writev, fd, buffers)
+
+
+async def list_files(path: str) -> List[str]:
+    """List the regular files in a directory (empty if it does not exist)"""
+    return await run(_list_files, path)
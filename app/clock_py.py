@@ -0,0 +1,31 @@
+"""
+Cached Timestamps
+Reuses formatted wall-clock timestamps across calls made within the same few milliseconds
+"""
+
+import time
+from datetime import datetime
+
+# How long a formatted timestamp is reused, in seconds
+_RESOLUTION = 0.01
+
+_iso_cache = [float("-inf"), ""]
+_log_cache = [float("-inf"), ""]
+
+
+def now_iso() -> str:
+    """Current local time in ISO 8601 format"""
+    now = time.monotonic()
+    if now - _iso_cache[0] >= _RESOLUTION:
+        _iso_cache[0] = now
+        _iso_cache[1] = datetime.now().isoformat()
+    return _iso_cache[1]
+
+
+def now_log_stamp() -> str:
+    """Current local time formatted for log file entries"""
+    now = time.monotonic()
+    if now - _log_cache[0] >= _RESOLUTION:
+        _log_cache[0] = now
+        _log_cache[1] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return _log_cache[1]
@@ -1,16 +1,45 @@
 import asyncio
+import time
 import websockets
-import json
+import orjson
+import simdjson
+import msgpack
 import logging
 from typing import Optional, Callable, Dict, Any
-from datetime import datetime
+from .clock import now_iso
 
 logger = logging.getLogger(__name__)
 
+# How our own outbound frames identify themselves when echoed back by the server
+_SELF_ECHO_MARKERS = ('"from":"poc-backend"', '"from": "poc-backend"')
+_SELF_ECHO_MARKERS_BYTES = tuple(marker.encode() for marker in _SELF_ECHO_MARKERS) + (
+    msgpack.packb("from") + msgpack.packb("poc-backend"),
+)
+
+# Wire formats the bridge can speak; JSON text frames are always understood
+WIRE_FORMATS = ("json", "msgpack")
+
+def _as_text(value: Any) -> Optional[str]:
+    """Plain string form of a decoded field (None stays None), detached from any simdjson document"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, simdjson.Object):
+        value = value.as_dict()
+    elif isinstance(value, simdjson.Array):
+        value = value.as_list()
+    return str(value)
+
 class ExternalWebSocketBridge:
     """Bridge to connect to external WebSocket servers and process messages with local agents"""
     
-    def __init__(self, external_url: str, user_id: str = "poc-backend"):
+    def __init__(
+        self,
+        external_url: str,
+        user_id: str = "poc-backend",
+        max_concurrent_handlers: int = 4,
+        wire_format: str = "json",
+        epoch_timestamps: bool = False
+    ):
         self.external_url = external_url
         self.user_id = user_id
         self.external_ws = None
@@ -19,6 +48,30 @@ class ExternalWebSocketBridge:
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 5
         
+        # Resolved once so reconnects reuse the same URL
+        base_url = external_url.rstrip('/')
+        if "{user_id}" in external_url:
+            self._final_url = external_url.replace("{user_id}", user_id)
+        elif base_url.endswith('/ws'):
+            self._final_url = f"{base_url}/{user_id}"
+        else:
+            self._final_url = f"{base_url}/ws/{user_id}"
+        
+        # Outbound frames switch to msgpack only once the peer has shown it speaks it too
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Unsupported wire format: {wire_format}")
+        self.wire_format = wire_format
+        self._peer_msgpack = False
+        
+        # Integer epoch nanoseconds instead of ISO strings, for peers that only machine-read timestamps
+        self.epoch_timestamps = epoch_timestamps
+        
+        # Caps in-flight handlers (each typically an LLM round-trip) across messages
+        self._handler_semaphore = asyncio.Semaphore(max_concurrent_handlers)
+        
+        # Reused across frames so simdjson keeps its internal buffers warm
+        self._json_parser = simdjson.Parser()
+        
     def add_message_handler(self, handler: Callable):
         """Add a handler function for incoming messages"""
         self.message_handlers.append(handler)
@@ -26,14 +79,7 @@ class ExternalWebSocketBridge:
     async def connect_to_external(self) -> bool:
         """Connect to the external WebSocket server"""
         try:
-            # Build connection URL
-            if "{user_id}" in self.external_url:
-                url = self.external_url.replace("{user_id}", self.user_id)
-            elif not self.external_url.endswith('/ws'):
-                url = f"{self.external_url.rstrip('/')}/ws/{self.user_id}"
-            else:
-                url = f"{self.external_url}/{self.user_id}"
-            
+            url = self._final_url
             logger.info(f"Connecting to external WebSocket: {url}")
             
             # Connect with timeout
@@ -44,13 +90,14 @@ class ExternalWebSocketBridge:
             
             self.is_connected = True
             self.reconnect_attempts = 0
+            self._peer_msgpack = False
             logger.info("Successfully connected to external WebSocket")
             
             # Start listening for messages from external socket
             asyncio.create_task(self._listen_to_external())
             
-            # Send initial connection message
-            await self.send_to_external("Hello! POC backend connected and ready.", "System")
+            # Send initial connection message, advertising our preferred wire format
+            await self.send_to_external("Hello! POC backend connected and ready.", "System", advertise_format=True)
             
             return True
             
@@ -59,7 +106,7 @@ class ExternalWebSocketBridge:
             self.is_connected = False
             return False
     
-    async def send_to_external(self, message: str, agent_name: str = "Assistant") -> bool:
+    async def send_to_external(self, message: str, agent_name: str = "Assistant", advertise_format: bool = False) -> bool:
         """Send message to external WebSocket"""
         if not self.is_connected or not self.external_ws:
             logger.warning("Cannot send to external WebSocket: not connected")
@@ -70,12 +117,17 @@ class ExternalWebSocketBridge:
             message_data = {
                 "message": message,
                 "agent": agent_name,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": time.time_ns() if self.epoch_timestamps else now_iso(),
                 "from": "poc-backend",
                 "type": "agent_response"
             }
+            if advertise_format:
+                message_data["format"] = self.wire_format
             
-            await self.external_ws.send(json.dumps(message_data))
+            if self.wire_format == "msgpack" and self._peer_msgpack:
+                await self.external_ws.send(msgpack.packb(message_data, use_bin_type=True))
+            else:
+                await self.external_ws.send(orjson.dumps(message_data).decode())
             logger.info(f"Sent to external WebSocket [{agent_name}]: {message[:100]}...")
             return True
             
@@ -106,38 +158,83 @@ class ExternalWebSocketBridge:
     async def _process_external_message(self, raw_message: str):
         """Process incoming message from external WebSocket"""
         try:
-            # Try to parse as JSON
-            try:
-                data = json.loads(raw_message)
-                message_content = data.get("message", data.get("content", str(data)))
-                sender = data.get("sender", data.get("from", data.get("user", "External User")))
-                message_type = data.get("type", "message")
-            except json.JSONDecodeError:
+            # Drop empty frames and echoes of our own messages before paying for a parse
+            if not raw_message or raw_message.isspace():
+                return
+            markers = _SELF_ECHO_MARKERS_BYTES if isinstance(raw_message, (bytes, bytearray)) else _SELF_ECHO_MARKERS
+            if any(marker in raw_message for marker in markers):
+                return
+            
+            # Binary frames may be msgpack; anything else goes through the JSON parser
+            data = None
+            if isinstance(raw_message, (bytes, bytearray)):
+                try:
+                    data = msgpack.unpackb(raw_message, raw=False)
+                except (ValueError, msgpack.UnpackException):
+                    data = None
+                if isinstance(data, dict):
+                    self._peer_msgpack = True
+                else:
+                    data = None
+            
+            # Try to parse as JSON, reading only the envelope fields we need
+            if data is None:
+                try:
+                    data = self._json_parser.parse(raw_message)
+                except ValueError:
+                    data = None
+            
+            if isinstance(data, (dict, simdjson.Object)):
+                # Copy fields out as plain Python values: simdjson proxies must not outlive the parse,
+                # and handlers expect strings
+                message_content = data.get("message", data.get("content", None))
+                if message_content is None and "message" not in data and "content" not in data:
+                    message_content = data if isinstance(data, dict) else data.as_dict()
+                message_content = _as_text(message_content)
+                sender = _as_text(data.get("sender", data.get("from", data.get("user", "External User"))))
+                message_type = _as_text(data.get("type", "message"))
+                origin = _as_text(data.get("from", ""))
+                if data.get("format") == "msgpack":
+                    self._peer_msgpack = True
+            else:
                 # Handle plain text messages
+                if isinstance(raw_message, (bytes, bytearray)):
+                    raw_message = raw_message.decode('utf-8', 'replace')
                 message_content = raw_message.strip()
                 sender = "External User"
                 message_type = "text"
+                origin = ""
+            
+            # Release the document so the parser can be reused for the next frame
+            del data
             
             # Skip empty messages
             if not message_content or message_content.strip() == "":
                 return
             
             # Skip our own messages
-            if sender == "poc-backend" or "poc-backend" in str(data.get("from", "")):
+            if sender == "poc-backend" or "poc-backend" in origin:
                 return
             
             logger.info(f"Processing external message from {sender}: {message_content}")
             
-            # Forward to all registered handlers
-            for handler in self.message_handlers:
-                try:
-                    await handler(message_content, sender, message_type)
-                except Exception as e:
-                    logger.error(f"Error in message handler: {e}")
+            # Forward to all registered handlers concurrently
+            await asyncio.gather(*[
+                self._run_handler(handler, message_content, sender, message_type)
+                for handler in self.message_handlers
+            ])
                     
         except Exception as e:
             logger.error(f"Error processing external message: {e}")
     
+    async def _run_handler(self, handler: Callable, message_content: str, sender: str, message_type: str):
+        """Run one message handler, bounded by the handler concurrency limit"""
+        async with self._handler_semaphore:
+            try:
+                await handler(message_content, sender, message_type)
+            except Exception as e:
+                logger.error(f"Error in message handler: {e}")
+    
     async def _attempt_reconnect(self):
         """Attempt to reconnect to external WebSocket"""
         if self.reconnect_attempts >= self.max_reconnect_attempts:
@@ -168,6 +265,7 @@ class ExternalWebSocketBridge:
             "connected": self.is_connected,
             "url": self.external_url,
             "user_id": self.user_id,
+            "wire_format": "msgpack" if self.wire_format == "msgpack" and self._peer_msgpack else "json",
             "reconnect_attempts": self.reconnect_attempts,
             "handlers_count": len(self.message_handlers)
         }
\ No newline at end of file
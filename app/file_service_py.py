@@ -1,36 +1,92 @@
-import aiofiles
-import json
+import asyncio
+import copy
+import orjson
 import os
-from datetime import datetime
-from typing import Dict, Any, List, Optional
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Tuple
 import logging
+from . import aio_backend
+from .clock import now_iso, now_log_stamp
 
 logger = logging.getLogger(__name__)
 
+_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+# A compacted journal opens with {"journal": <id>}; the snapshot it was merged into records that id
+_JOURNAL_ID_KEY = "journal"
+_COMPACTED_JOURNAL_KEY = "compacted_journal"
+
+def _split_journal(records: List[Dict[str, Any]]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """Separate a journal's id header (None for a journal never compacted) from its records"""
+    if records and len(records[0]) == 1 and _JOURNAL_ID_KEY in records[0]:
+        return records[0][_JOURNAL_ID_KEY], records[1:]
+    return None, records
+
+def _unmerged_records(snapshot: Optional[Dict[str, Any]], records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Journal records not yet in the snapshot; all of them were if a compaction stopped before rotating the journal"""
+    journal_id, records = _split_journal(records)
+    if journal_id is not None and snapshot is not None and snapshot.get(_COMPACTED_JOURNAL_KEY) == journal_id:
+        return []
+    return records
+
+def _journal_header(journal_id: str) -> bytes:
+    """First line of a journal tagged with the given id"""
+    return orjson.dumps({_JOURNAL_ID_KEY: journal_id}, option=orjson.OPT_APPEND_NEWLINE)
+
 class FileService:
-    def __init__(self, base_dir: str = "user_contexts"):
+    def __init__(
+        self,
+        base_dir: str = "user_contexts",
+        journal_compact_bytes: int = 64 * 1024,
+        flush_interval: float = 5.0,
+        cache_max_entries: int = 1024,
+        log_batch_size: int = 64,
+        log_idle_timeout: float = 30.0
+    ):
         self.base_dir = base_dir
+        self.journal_compact_bytes = journal_compact_bytes
+        self.flush_interval = flush_interval
+        self.cache_max_entries = cache_max_entries
+        self.log_batch_size = log_batch_size
+        self.log_idle_timeout = log_idle_timeout
+        self._journal_locks: Dict[str, asyncio.Lock] = {}
+        self._journal_sizes: Dict[str, int] = {}
+        self._ensured_dirs = {base_dir}
+        
+        # Write-back JSON cache: (user_id, filename) -> [data, dirty, last_flush]
+        self._json_cache: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+        self._cache_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        # Per-(user_id, filename) log queues, each drained by one writer task
+        self._log_writers: Dict[Tuple[str, str], asyncio.Queue] = {}
+        self._log_tasks: Dict[Tuple[str, str], asyncio.Task] = {}
         os.makedirs(base_dir, exist_ok=True)
     
     def get_user_dir(self, user_id: str) -> str:
         """Get user-specific directory"""
         user_dir = os.path.join(self.base_dir, user_id)
-        os.makedirs(user_dir, exist_ok=True)
+        if user_dir not in self._ensured_dirs:
+            os.makedirs(user_dir, exist_ok=True)
+            self._ensured_dirs.add(user_dir)
         return user_dir
     
     async def save_json(self, user_id: str, filename: str, data: Dict[str, Any]) -> bool:
-        """Save data as JSON file"""
+        """Save data as JSON file (written back to disk by the background flusher)"""
         try:
-            user_dir = self.get_user_dir(user_id)
-            filepath = os.path.join(user_dir, filename)
-            
             # Add timestamp to data
-            data["last_updated"] = datetime.now().isoformat()
+            data["last_updated"] = now_iso()
             
-            async with aiofiles.open(filepath, 'w') as f:
-                await f.write(json.dumps(data, indent=2, default=str))
+            key = (user_id, filename)
+            self._json_cache[key] = [copy.deepcopy(data), True, time.time()]
+            self._json_cache.move_to_end(key)
+            await self._evict_json_cache()
+            
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_loop())
             
-            logger.debug(f"Saved JSON to {filepath}")
             return True
             
         except Exception as e:
@@ -38,63 +94,324 @@ class FileService:
             return False
     
     async def load_json(self, user_id: str, filename: str) -> Optional[Dict[str, Any]]:
-        """Load data from JSON file"""
+        """Load data from JSON file, served from the write-back cache when possible"""
         try:
+            key = (user_id, filename)
+            entry = self._json_cache.get(key)
+            if entry is not None:
+                self._json_cache.move_to_end(key)
+                return copy.deepcopy(entry[0])
+            
             user_dir = self.get_user_dir(user_id)
             filepath = os.path.join(user_dir, filename)
             
             if not os.path.exists(filepath):
                 return None
             
-            async with aiofiles.open(filepath, 'r') as f:
-                content = await f.read()
-                return json.loads(content)
+            data = orjson.loads(await aio_backend.read_bytes(filepath))
+            self._json_cache[key] = [data, False, time.time()]
+            await self._evict_json_cache()
+            return copy.deepcopy(data)
                 
         except Exception as e:
             logger.error(f"Error loading JSON {filename} for user {user_id}: {e}")
             return None
     
-    async def log_to_file(self, user_id: str, filename: str, content: str) -> bool:
-        """Append content to a log file"""
+    def peek_json(self, user_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Return the live cached data for a file without touching disk, or None if it is not cached"""
+        entry = self._json_cache.get((user_id, filename))
+        if entry is None:
+            return None
+        self._json_cache.move_to_end((user_id, filename))
+        return entry[0]
+    
+    async def _write_json_file(self, user_id: str, filename: str, data: Dict[str, Any]) -> None:
+        """Atomically write a JSON file via a temp file and rename"""
+        filepath = os.path.join(self.get_user_dir(user_id), filename)
+        await aio_backend.write_bytes(filepath, orjson.dumps(data, default=str, option=_JSON_OPTIONS), atomic=True)
+        
+        logger.debug(f"Saved JSON to {filepath}")
+    
+    async def _flush_entry(self, key: Tuple[str, str]) -> None:
+        """Write a dirty cache entry to disk"""
+        entry = self._json_cache.get(key)
+        if entry is None or not entry[1]:
+            return
+        
+        data = entry[0]
+        await self._write_json_file(key[0], key[1], data)
+        
+        # Only mark clean if nothing was saved over the entry while writing
+        if entry[0] is data:
+            entry[1] = False
+            entry[2] = time.time()
+    
+    async def flush(self, user_id: Optional[str] = None, filename: Optional[str] = None) -> None:
+        """Write dirty cached JSON to disk, optionally only a single file"""
+        async with self._cache_lock:
+            if user_id is not None and filename is not None:
+                keys = [(user_id, filename)]
+            else:
+                keys = [key for key, entry in self._json_cache.items() if entry[1]]
+            
+            for key in keys:
+                try:
+                    await self._flush_entry(key)
+                except Exception as e:
+                    logger.error(f"Error flushing JSON {key[1]} for user {key[0]}: {e}")
+    
+    async def _flush_loop(self):
+        """Periodically write dirty cached JSON to disk"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    async def _evict_json_cache(self) -> None:
+        """Drop least recently used cache entries, writing them first if dirty"""
+        while len(self._json_cache) > self.cache_max_entries:
+            key, (data, dirty, _) = self._json_cache.popitem(last=False)
+            if dirty:
+                try:
+                    await self._write_json_file(key[0], key[1], data)
+                except Exception as e:
+                    logger.error(f"Error flushing evicted JSON {key[1]} for user {key[0]}: {e}")
+    
+    async def close(self) -> None:
+        """Stop the background flusher and log writers and write all pending data"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        
+        for queue in list(self._log_writers.values()):
+            await queue.join()
+        for task in list(self._log_tasks.values()):
+            task.cancel()
+    
+    def _journal_lock(self, filepath: str) -> asyncio.Lock:
+        """Get the lock serializing appends and compaction of a journal"""
+        lock = self._journal_locks.get(filepath)
+        if lock is None:
+            lock = self._journal_locks[filepath] = asyncio.Lock()
+        return lock
+    
+    async def append_jsonl(self, user_id: str, filename: str, record: Dict[str, Any]) -> bool:
+        """Append a single record to a JSONL journal"""
+        try:
+            user_dir = self.get_user_dir(user_id)
+            filepath = os.path.join(user_dir, filename)
+            line = orjson.dumps(record, default=str, option=orjson.OPT_APPEND_NEWLINE)
+            
+            async with self._journal_lock(filepath):
+                self._journal_sizes[filepath] = await aio_backend.append_bytes(filepath, line)
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error appending to journal {filename} for user {user_id}: {e}")
+            return False
+    
+    async def load_jsonl(self, user_id: str, filename: str) -> List[Dict[str, Any]]:
+        """Load all records from a JSONL journal"""
+        try:
+            user_dir = self.get_user_dir(user_id)
+            filepath = os.path.join(user_dir, filename)
+            
+            if not os.path.exists(filepath):
+                return []
+            
+            content = await aio_backend.read_bytes(filepath)
+            return [orjson.loads(line) for line in content.split(b"\n") if line]
+            
+        except Exception as e:
+            logger.error(f"Error loading journal {filename} for user {user_id}: {e}")
+            return []
+    
+    def journal_size(self, user_id: str, filename: str) -> int:
+        """Get the size in bytes of a JSONL journal as of its last append or compaction (0 if not seen yet)"""
+        return self._journal_sizes.get(os.path.join(self.get_user_dir(user_id), filename), 0)
+    
+    async def load_journaled(
+        self,
+        user_id: str,
+        filename: str,
+        snapshot_filename: str,
+        replay: Callable[[Optional[Dict[str, Any]], List[Dict[str, Any]]], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Rebuild state from a JSON snapshot plus the records journaled since"""
+        filepath = os.path.join(self.get_user_dir(user_id), filename)
+        async with self._journal_lock(filepath):
+            snapshot = await self.load_json(user_id, snapshot_filename)
+            records = await self.load_jsonl(user_id, filename)
+        data = replay(snapshot, _unmerged_records(snapshot, records))
+        
+        # Keep the rebuilt state under the journal's key (clean, never written back) so peek_json can serve it
+        key = (user_id, filename)
+        self._json_cache[key] = [data, False, time.time()]
+        self._json_cache.move_to_end(key)
+        await self._evict_json_cache()
+        return data
+    
+    async def compact_jsonl(
+        self,
+        user_id: str,
+        filename: str,
+        snapshot_filename: str,
+        replay: Callable[[Optional[Dict[str, Any]], List[Dict[str, Any]]], Dict[str, Any]]
+    ) -> bool:
+        """Merge a JSONL journal into its JSON snapshot and start a fresh journal"""
         try:
             user_dir = self.get_user_dir(user_id)
             filepath = os.path.join(user_dir, filename)
             
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_entry = f"[{timestamp}] {content}\n"
+            async with self._journal_lock(filepath):
+                records = await self.load_jsonl(user_id, filename)
+                journal_id, events = _split_journal(records)
+                if not events:
+                    return True
+                
+                # Tag the journal before merging it so a crash after the snapshot write cannot replay it twice
+                if journal_id is None:
+                    journal_id = uuid.uuid4().hex
+                    content = _journal_header(journal_id) + b"".join(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records)
+                    await aio_backend.write_bytes(filepath, content, atomic=True)
+                
+                snapshot = await self.load_json(user_id, snapshot_filename)
+                events = _unmerged_records(snapshot, [{_JOURNAL_ID_KEY: journal_id}, *events])
+                if events:
+                    data = replay(snapshot, events)
+                    data[_COMPACTED_JOURNAL_KEY] = journal_id
+                    if not await self.save_json(user_id, snapshot_filename, data):
+                        return False
+                    
+                    # The snapshot must hit disk before the journal is dropped
+                    await self.flush(user_id, snapshot_filename)
+                    entry = self._json_cache.get((user_id, snapshot_filename))
+                    if entry is not None and entry[1]:
+                        return False
+                
+                header = _journal_header(uuid.uuid4().hex)
+                await aio_backend.write_bytes(filepath, header, atomic=True)
+                self._journal_sizes[filepath] = len(header)
+            
+            logger.debug(f"Compacted {filepath} into {snapshot_filename}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error compacting journal {filename} for user {user_id}: {e}")
+            return False
+    
+    async def log_to_file(self, user_id: str, filename: str, content: str) -> bool:
+        """Append content to a log file (queued and written in batches)"""
+        return self.log_nowait(user_id, filename, content)
+    
+    def log_nowait(self, user_id: str, filename: str, content: str) -> bool:
+        """Queue content for appending to a log file without waiting for the write"""
+        try:
+            timestamp = now_log_stamp()
+            log_entry = f"[{timestamp}] {content}\n".encode('utf-8', 'replace')
             
-            async with aiofiles.open(filepath, 'a', encoding='utf-8') as f:
-                await f.write(log_entry)
+            key = (user_id, filename)
+            queue = self._log_writers.get(key)
+            if queue is None:
+                filepath = os.path.join(self.get_user_dir(user_id), filename)
+                queue = self._log_writers[key] = asyncio.Queue()
+                self._log_tasks[key] = asyncio.create_task(self._log_writer(key, filepath, queue))
             
+            queue.put_nowait(log_entry)
             return True
             
         except Exception as e:
             logger.error(f"Error logging to {filename} for user {user_id}: {e}")
             return False
     
+    async def _log_writer(self, key: Tuple[str, str], filepath: str, queue: asyncio.Queue):
+        """Drain a log queue, writing everything pending with one writev per batch"""
+        try:
+            fd = await aio_backend.run(os.open, filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except Exception as e:
+            logger.error(f"Error opening log {key[1]} for user {key[0]}: {e}")
+            # Unregister so later entries start a fresh writer, and drop what is queued so join() returns
+            if self._log_writers.get(key) is queue:
+                del self._log_writers[key]
+                del self._log_tasks[key]
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
+            return
+        
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(queue.get(), self.log_idle_timeout)
+                except asyncio.TimeoutError:
+                    # Idle: retire the writer and release its file descriptor
+                    if queue.empty():
+                        del self._log_writers[key]
+                        del self._log_tasks[key]
+                        return
+                    continue
+                
+                batch = [first]
+                while len(batch) < self.log_batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                
+                try:
+                    await aio_backend.writev(fd, batch)
+                except Exception as e:
+                    logger.error(f"Error logging to {key[1]} for user {key[0]}: {e}")
+                finally:
+                    for _ in batch:
+                        queue.task_done()
+        finally:
+            os.close(fd)
+    
+    async def drain_logs(self, user_id: str, filename: str) -> None:
+        """Wait until queued log entries for a file have been written"""
+        queue = self._log_writers.get((user_id, filename))
+        if queue is not None:
+            await queue.join()
+    
     async def read_file(self, user_id: str, filename: str) -> Optional[str]:
         """Read entire file content"""
         try:
+            await self.flush(user_id, filename)
+            await self.drain_logs(user_id, filename)
+            
             user_dir = self.get_user_dir(user_id)
             filepath = os.path.join(user_dir, filename)
             
             if not os.path.exists(filepath):
                 return None
             
-            async with aiofiles.open(filepath, 'r', encoding='utf-8') as f:
-                return await f.read()
+            content = await aio_backend.read_bytes(filepath)
+            return content.decode('utf-8')
                 
         except Exception as e:
             logger.error(f"Error reading {filename} for user {user_id}: {e}")
             return None
     
+    async def tail_lines(self, user_id: str, filename: str, n: int) -> Optional[List[str]]:
+        """Read the last n lines of a file"""
+        try:
+            await self.drain_logs(user_id, filename)
+            
+            user_dir = self.get_user_dir(user_id)
+            filepath = os.path.join(user_dir, filename)
+            
+            if not os.path.exists(filepath):
+                return None
+            
+            return await aio_backend.tail_lines(filepath, n)
+            
+        except Exception as e:
+            logger.error(f"Error reading tail of {filename} for user {user_id}: {e}")
+            return None
+    
     async def list_user_files(self, user_id: str) -> List[str]:
         """List all files for a user"""
         try:
-            user_dir = self.get_user_dir(user_id)
-            if os.path.exists(user_dir):
-                return [f for f in os.listdir(user_dir) if os.path.isfile(os.path.join(user_dir, f))]
-            return []
+            return await aio_backend.list_files(self.get_user_dir(user_id))
             
         except Exception as e:
             logger.error(f"Error listing files for user {user_id}: {e}")
@@ -103,6 +420,8 @@ class FileService:
     async def delete_file(self, user_id: str, filename: str) -> bool:
         """Delete a specific file"""
         try:
+            self._json_cache.pop((user_id, filename), None)
+            
             user_dir = self.get_user_dir(user_id)
             filepath = os.path.join(user_dir, filename)
             
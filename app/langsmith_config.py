@@ -3,19 +3,26 @@ LangSmith Configuration and Utilities
 Centralized configuration for LangSmith tracing across the multi-agent system
 """
 
+import asyncio
+import functools
 import os
 import logging
-from typing import Optional, Dict, Any
-from langsmith import Client
-from langsmith.evaluation import evaluate, LangChainStringEvaluator
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+from langsmith import Client, traceable
 
 logger = logging.getLogger(__name__)
 
+# Fraction of calls decorated with sampled_traceable that are actually traced
+DEFAULT_SAMPLE_RATE = float(os.getenv("LANGSMITH_SAMPLE_RATE", "0.05"))
+
 
 class LangSmithConfig:
     """Centralized LangSmith configuration and utilities"""
     
-    def __init__(self):
+    def __init__(self, batch_size: int = 100, flush_interval: float = 0.5, max_queue: int = 10000):
         self.enabled = os.getenv("LANGCHAIN_TRACING_V2", "false").lower() == "true"
         self.api_key = os.getenv("LANGCHAIN_API_KEY")
         self.project = os.getenv("LANGCHAIN_PROJECT", "multi-agent-poc-backend")
@@ -31,6 +38,13 @@ class LangSmithConfig:
         elif self.enabled:
             logger.warning("LangSmith tracing enabled but no API key provided")
             self.enabled = False
+        
+        # Runs are queued and ingested in batches by a background task instead of posted inline
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._flush_task: Optional[asyncio.Task] = None
     
     def is_enabled(self) -> bool:
         """Check if LangSmith tracing is enabled and properly configured"""
@@ -40,6 +54,72 @@ class LangSmithConfig:
         """Get the LangSmith client instance"""
         return self.client
     
+    def _enqueue_run(self, run_data: Dict[str, Any]) -> None:
+        """Queue a run for batched ingestion, dropping it if the queue is full"""
+        run_id = uuid.uuid4()
+        now = datetime.now(timezone.utc)
+        run_data.update({
+            "id": run_id,
+            "trace_id": run_id,
+            "dotted_order": f"{now.strftime('%Y%m%dT%H%M%S%fZ')}{run_id}",
+            "start_time": now,
+            "end_time": now,
+            "session_name": self.project
+        })
+        
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to batch on (e.g. a script); send it directly
+            self.client.batch_ingest_runs(create=[run_data])
+            return
+        
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        
+        try:
+            self._queue.put_nowait(run_data)
+        except asyncio.QueueFull:
+            logger.warning(f"LangSmith run queue full ({self.max_queue}), dropping {run_data['name']}")
+    
+    async def _flush_loop(self):
+        """Ingest queued runs in batches of up to batch_size, at least every flush_interval"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._ingest(batch)
+    
+    async def _ingest(self, batch: List[Dict[str, Any]]) -> None:
+        """Send a batch of runs to LangSmith off the event loop"""
+        try:
+            await asyncio.to_thread(self.client.batch_ingest_runs, create=batch)
+            logger.debug(f"Ingested {len(batch)} runs to LangSmith")
+        except Exception as e:
+            logger.warning(f"Failed to ingest {len(batch)} runs to LangSmith: {e}")
+    
+    async def close(self) -> None:
+        """Stop the background flusher and ingest any runs still queued"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        
+        if self._queue is not None:
+            remaining = []
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            for start in range(0, len(remaining), self.batch_size):
+                await self._ingest(remaining[start:start + self.batch_size])
+    
     def log_agent_interaction(
         self, 
         agent_name: str, 
@@ -66,8 +146,8 @@ class LangSmithConfig:
                 }
             }
             
-            self.client.create_run(**run_data)
-            logger.debug(f"Logged {agent_name} interaction to LangSmith")
+            self._enqueue_run(run_data)
+            logger.debug(f"Queued {agent_name} interaction for LangSmith")
             
         except Exception as e:
             logger.warning(f"Failed to log interaction to LangSmith: {e}")
@@ -103,8 +183,8 @@ class LangSmithConfig:
                 }
             }
             
-            self.client.create_run(**run_data)
-            logger.debug(f"Logged routing decision to LangSmith: {selected_agent}")
+            self._enqueue_run(run_data)
+            logger.debug(f"Queued routing decision for LangSmith: {selected_agent}")
             
         except Exception as e:
             logger.warning(f"Failed to log routing decision to LangSmith: {e}")
@@ -139,8 +219,8 @@ class LangSmithConfig:
             if error:
                 run_data["error"] = error
             
-            self.client.create_run(**run_data)
-            logger.debug(f"Logged tool execution to LangSmith: {tool_name}")
+            self._enqueue_run(run_data)
+            logger.debug(f"Queued tool execution for LangSmith: {tool_name}")
             
         except Exception as e:
             logger.warning(f"Failed to log tool execution to LangSmith: {e}")
@@ -190,4 +270,22 @@ def get_langsmith_config() -> LangSmithConfig:
 
 def is_tracing_enabled() -> bool:
     """Quick check if tracing is enabled"""
-    return langsmith_config.is_enabled()
\ No newline at end of file
+    return langsmith_config.is_enabled()
+
+
+def sampled_traceable(name: str, sample_rate: Optional[float] = None):
+    """Like langsmith's traceable for async functions, but only traces a random sample of calls"""
+    rate = DEFAULT_SAMPLE_RATE if sample_rate is None else sample_rate
+    
+    def decorator(func):
+        traced = traceable(name=name)(func)
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if random.random() < rate:
+                return await traced(*args, **kwargs)
+            return await func(*args, **kwargs)
+        
+        return wrapper
+    
+    return decorator
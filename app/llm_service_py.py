@@ -1,47 +1,498 @@
+import asyncio
+import diskcache
+import hashlib
+import httpx
 import openai
 import os
-import json
 import logging
-from typing import List, Dict, Any, Optional
-from langsmith import traceable, Client
+import re
+import time
+import numpy as np
+import orjson
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
+from langsmith import Client
 from langsmith.wrappers import wrap_openai
 from .models import Message, AgentIntent
+from .langsmith_config import sampled_traceable
 
 logger = logging.getLogger(__name__)
 
+# One connection pool shared by every OpenAI client in the process
+_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=30),
+    timeout=httpx.Timeout(60.0, connect=5.0)
+)
+
+# Weighted domain vocabulary; a confident score lets classify_intent skip the LLM
+_KEYWORD_WEIGHTS: Dict[str, Tuple[str, float]] = {
+    **dict.fromkeys(["workout", "workouts", "exercise", "exercises", "exercising", "fitness", "leg day"], ("helios", 1.0)),
+    **dict.fromkeys(["squat", "squats", "deadlift", "deadlifts", "bench press", "crossfit", "hiit", "cardio"], ("helios", 1.0)),
+    **dict.fromkeys(["gym", "training", "marathon", "pilates", "yoga", "push-up", "push-ups", "pushup", "pushups"], ("helios", 0.8)),
+    **dict.fromkeys(["pull-up", "pull-ups", "pullup", "pullups", "plank", "reps", "muscle", "muscles"], ("helios", 0.8)),
+    **dict.fromkeys(["lift", "lifts", "lifting", "sprint", "sprints", "jogging", "swimming", "cycling", "stretching"], ("helios", 0.6)),
+    **dict.fromkeys(["train", "running", "sets", "abs", "stretch"], ("helios", 0.4)),
+    **dict.fromkeys(["nutrition", "diet", "meal", "meals", "recipe", "recipes", "calories", "macros"], ("ceres", 1.0)),
+    **dict.fromkeys(["food", "breakfast", "lunch", "dinner", "protein", "carbs", "vegetarian", "vegan", "keto"], ("ceres", 0.8)),
+    **dict.fromkeys(["eat", "eats", "eating", "ate", "hungry", "snack", "snacks", "cooking", "groceries"], ("ceres", 0.8)),
+    **dict.fromkeys(["salad", "smoothie", "fiber", "vitamins", "gluten", "cook", "grocery"], ("ceres", 0.6)),
+    **dict.fromkeys(["sugar", "carb", "vitamin"], ("ceres", 0.4)),
+}
+# One alternation, longest terms first, so the message is scanned once for every domain
+_KEYWORD_PATTERN = re.compile(
+    r"\b(?:" + "|".join(re.escape(term) for term in sorted(_KEYWORD_WEIGHTS, key=len, reverse=True)) + r")\b"
+)
+# A single-domain score needs this much weight; a mixed message needs this much and twice the runner-up
+_KEYWORD_MIN_SCORE = 0.8
+_KEYWORD_DOMINANT_SCORE = 2.0
+
+# Static routing prompt; the conversation context and message are sent as the user turn
+_CLASSIFY_SYSTEM_PROMPT = """
+You are a message router for a multi-agent system. Analyze the user's message, given the recent conversation context, and determine which agent should handle it.
+
+Available agents:
+- helios: Handles fitness, workouts, exercise, training, gym activities, physical health, sports
+- ceres: Handles nutrition, food, meals, diet, recipes, cooking, eating habits, dietary advice
+- general: For greetings, general questions, chitchat, or unclear requests
+
+Respond with a JSON object containing:
+{
+    "agent": "agent_name",
+    "confidence": 0.8,
+    "reasoning": "explanation of why this agent was chosen"
+}
+
+Rules:
+- Route fitness/exercise/workout questions to helios
+- Route food/nutrition/diet questions to ceres
+- Route greetings and general chat to general
+- If uncertain, use general with lower confidence
+- Confidence should be 0.0-1.0
+"""
+
+# Routing rules sent once per batch of classification requests
+_CLASSIFY_BATCH_PROMPT = """
+You are a message router for a multi-agent system. You will receive a JSON array of user messages, each with an "id", the user's "message" and the recent conversation "context". Decide which agent should handle each message.
+
+Available agents:
+- helios: Handles fitness, workouts, exercise, training, gym activities, physical health, sports
+- ceres: Handles nutrition, food, meals, diet, recipes, cooking, eating habits, dietary advice
+- general: For greetings, general questions, chitchat, or unclear requests
+
+Respond with a JSON object whose "results" array holds one entry per input message, in any order:
+{
+    "results": [
+        {"id": 0, "agent": "agent_name", "confidence": 0.8, "reasoning": "explanation of why this agent was chosen"}
+    ]
+}
+
+Rules:
+- Route fitness/exercise/workout questions to helios
+- Route food/nutrition/diet questions to ceres
+- Route greetings and general chat to general
+- If uncertain, use general with lower confidence
+- Confidence should be 0.0-1.0
+"""
+
+# Structured output schemas so classifier replies always parse
+_INTENT_PROPERTIES = {
+    "agent": {"type": "string", "enum": ["helios", "ceres", "general"]},
+    "confidence": {"type": "number"},
+    "reasoning": {"type": "string"}
+}
+_INTENT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "AgentIntent",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": _INTENT_PROPERTIES,
+            "required": ["agent", "confidence", "reasoning"],
+            "additionalProperties": False
+        }
+    }
+}
+_INTENT_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "AgentIntentBatch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, **_INTENT_PROPERTIES},
+                        "required": ["id", "agent", "confidence", "reasoning"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["results"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Strict schemas emit keys in declaration order, so agent and confidence arrive before the reasoning
+_STREAMED_INTENT = re.compile(
+    r'"agent"\s*:\s*"(?P<agent>helios|ceres|general)"\s*,\s*"confidence"\s*:\s*(?P<confidence>-?\d+(?:\.\d+)?)\s*[,}]'
+)
+_STREAMED_BATCH_INTENT = re.compile(r'"id"\s*:\s*(?P<id>\d+)\s*,\s*' + _STREAMED_INTENT.pattern)
+
+# Messages this short with no domain keyword are treated as chit-chat
+_SHORT_MESSAGE_CHARS = 20
+
+class LLMClientPool:
+    """Pool of OpenAI-compatible endpoints with per-endpoint concurrency limits and failover"""
+    
+    def __init__(self, clients: List[openai.AsyncOpenAI], concurrency_limit: int = 16):
+        self.clients = clients
+        self._semaphores = [asyncio.Semaphore(concurrency_limit) for _ in clients]
+        self._in_flight = [0] * len(clients)
+        self._next = 0
+    
+    @classmethod
+    def from_env(cls, wrap_client=None) -> "LLMClientPool":
+        """Build a pool from OPENAI_BASE_URLS (comma-separated), defaulting to the standard endpoint"""
+        base_urls = [url.strip() for url in os.getenv("OPENAI_BASE_URLS", "").split(",") if url.strip()]
+        clients = []
+        for base_url in base_urls or [None]:
+            client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url, http_client=_http_client)
+            clients.append(wrap_client(client) if wrap_client else client)
+        
+        return cls(clients, int(os.getenv("OPENAI_ENDPOINT_CONCURRENCY", "16")))
+    
+    def _endpoint_order(self) -> List[int]:
+        """Least-loaded endpoints first; slow endpoints hold more in-flight requests and get fewer new ones"""
+        count = len(self.clients)
+        start = self._next
+        self._next = (self._next + 1) % count
+        rotation = [(start + offset) % count for offset in range(count)]
+        return sorted(rotation, key=lambda index: self._in_flight[index])
+    
+    async def create_chat_completion(self, **kwargs):
+        """Create a chat completion, failing over to the next endpoint on 5xx, timeout or connection errors"""
+        last_error = None
+        for index in self._endpoint_order():
+            self._in_flight[index] += 1
+            try:
+                async with self._semaphores[index]:
+                    return await self.clients[index].chat.completions.create(**kwargs)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                logger.warning(f"LLM endpoint {index} failed, trying next: {e}")
+                last_error = e
+            finally:
+                self._in_flight[index] -= 1
+        
+        raise last_error
+
+class ResponseCache:
+    """LRU cache of completion results with a time-to-live"""
+    
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+    
+    @staticmethod
+    def make_key(*parts: Any) -> bytes:
+        return hashlib.blake2b(repr(parts).encode(), digest_size=16).digest()
+    
+    def get(self, key: bytes) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+    
+    def put(self, key: bytes, value: str) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+class SemanticIntentCache:
+    """Intent classifications keyed by message embedding, matched by cosine similarity"""
+    
+    # Rows upcast per block during a scan, so the int8 corpus never needs a full float32 copy
+    SCAN_BLOCK_ROWS = 2048
+    
+    def __init__(self, threshold: float = 0.92, max_entries: int = 10000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Unit-length rows quantized to int8 with a per-row scale; allocated on first add
+        self._quantized: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._last_used: Optional[np.ndarray] = None
+        self._results: List[AgentIntent] = []
+        self._count = 0
+        self._clock = 0
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    @staticmethod
+    def _quantize(vector: np.ndarray) -> Tuple[np.ndarray, float]:
+        peak = float(np.abs(vector).max())
+        scale = 127.0 / peak if peak else 1.0
+        return np.round(vector * scale).astype(np.int8), scale
+    
+    def _touch(self, index: int) -> None:
+        self._clock += 1
+        self._last_used[index] = self._clock
+    
+    def _similarities(self, query: np.ndarray) -> np.ndarray:
+        similarities = np.empty(self._count, dtype=np.float32)
+        for start in range(0, self._count, self.SCAN_BLOCK_ROWS):
+            stop = min(start + self.SCAN_BLOCK_ROWS, self._count)
+            similarities[start:stop] = self._quantized[start:stop].astype(np.float32) @ query
+        return similarities / self._scales[:self._count]
+    
+    def lookup(self, embedding: np.ndarray) -> Optional[AgentIntent]:
+        """Return the cached intent of the most similar message, with confidence scaled by similarity"""
+        if not self._count:
+            return None
+        
+        similarities = self._similarities(self._normalize(embedding))
+        best = int(np.argmax(similarities))
+        similarity = min(float(similarities[best]), 1.0)
+        if similarity < self.threshold:
+            return None
+        
+        self._touch(best)
+        cached = self._results[best]
+        return cached.model_copy(update={
+            "confidence": cached.confidence * similarity,
+            "reasoning": f"{cached.reasoning} (cached, similarity {similarity:.2f})"
+        })
+    
+    def add(self, embedding: np.ndarray, intent: AgentIntent) -> None:
+        """Remember a classification, evicting the least recently used entry when full"""
+        quantized, scale = self._quantize(self._normalize(embedding))
+        self._insert(quantized, scale, intent)
+    
+    def _insert(self, quantized: np.ndarray, scale: float, intent: AgentIntent) -> int:
+        if self._quantized is None:
+            self._quantized = np.zeros((self.max_entries, quantized.shape[0]), dtype=np.int8)
+            self._scales = np.ones(self.max_entries, dtype=np.float32)
+            self._last_used = np.zeros(self.max_entries, dtype=np.int64)
+        
+        if self._count < self.max_entries:
+            index = self._count
+            self._count += 1
+            self._results.append(intent)
+        else:
+            index = int(np.argmin(self._last_used))
+            self._results[index] = intent
+        
+        self._quantized[index] = quantized
+        self._scales[index] = scale
+        self._touch(index)
+        return index
+    
+    def export(self) -> Dict[str, np.ndarray]:
+        """Copy the cache contents into arrays suitable for np.savez"""
+        results = orjson.dumps([intent.model_dump() for intent in self._results])
+        return {
+            "quantized": self._quantized[:self._count].copy(),
+            "scales": self._scales[:self._count].copy(),
+            "last_used": self._last_used[:self._count].copy(),
+            "results": np.frombuffer(results, dtype=np.uint8)
+        }
+    
+    def load(self, path: str) -> None:
+        """Restore entries saved from export()"""
+        with np.load(path) as saved:
+            results = orjson.loads(saved["results"].tobytes())
+            if "quantized" in saved:
+                rows = zip(saved["quantized"], saved["scales"])
+            else:
+                # Older float32 snapshots
+                rows = (self._quantize(self._normalize(embedding)) for embedding in saved["embeddings"])
+            
+            for (quantized, scale), last_used, result in zip(rows, saved["last_used"], results):
+                index = self._insert(quantized, float(scale), AgentIntent(**result))
+                self._last_used[index] = last_used
+            self._clock = int(saved["last_used"].max(initial=0))
+
+def _parse_classifier_json(response: str) -> Any:
+    """Parse a classifier reply, reporting the text when it is not JSON (e.g. an error apology)"""
+    try:
+        return orjson.loads(response)
+    except orjson.JSONDecodeError:
+        raise ValueError(f"Classifier returned non-JSON output: {response[:100]}")
+
+def _intent_from_data(intent_data: Dict[str, Any]) -> AgentIntent:
+    """Build an AgentIntent from a classifier JSON object"""
+    return AgentIntent(
+        agent=intent_data.get("agent", "general"),
+        confidence=float(intent_data.get("confidence", 0.5)),
+        reasoning=intent_data.get("reasoning", "Default routing"),
+        extracted_params=intent_data.get("extracted_params", {})
+    )
+
+class _ClassifyBatcher:
+    """Collects classification requests arriving within a short window into one completion"""
+    
+    def __init__(self, service: "LLMService", max_batch: int = 8, window: float = 0.02):
+        self.service = service
+        self.max_batch = max_batch
+        self.window = window
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batches = set()
+    
+    async def classify(self, message: str, history_context: str) -> AgentIntent:
+        """Queue a message for the next batch and wait for its intent"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((message, history_context, future))
+        return await future
+    
+    async def _run(self):
+        """Cut a batch when it is full or the window since its first request has passed"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Don't hold up the next window while this batch is in flight
+            task = asyncio.create_task(self._dispatch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+    
+    async def _dispatch(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        """Classify a batch, resolving each caller's future as soon as its intent is known"""
+        def resolve(index: int, intent: AgentIntent):
+            future = batch[index][2]
+            if not future.done():
+                future.set_result(intent)
+        
+        try:
+            if len(batch) == 1:
+                message, history_context, _ = batch[0]
+                resolve(0, await self.service._classify_single(message, history_context))
+            else:
+                await self.service._classify_batch([(message, context) for message, context, _ in batch], resolve)
+            
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(ValueError("No classification returned for message"))
+                    
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    async def close(self):
+        """Stop batching and wait for in-flight batches"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
 class LLMService:
-    def __init__(self):
-        self.client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, enable_langsmith: Optional[bool] = None):
+        # Wrap OpenAI clients with LangSmith tracing if enabled (defaults to LANGCHAIN_TRACING_V2)
+        if enable_langsmith is None:
+            enable_langsmith = os.getenv("LANGCHAIN_TRACING_V2") == "true"
         
-        # Wrap OpenAI client with LangSmith tracing if enabled
-        if os.getenv("LANGCHAIN_TRACING_V2") == "true":
-            self.client = wrap_openai(self.client)
+        if enable_langsmith:
+            self.pool = LLMClientPool.from_env(wrap_client=wrap_openai)
             self.langsmith_client = Client()
             logger.info("LangSmith tracing enabled for LLM service")
         else:
+            self.pool = LLMClientPool.from_env()
             self.langsmith_client = None
             logger.info("LangSmith tracing disabled")
-            
+        
+        self.client = self.pool.clients[0]
         self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        self.response_cache = ResponseCache(
+            max_size=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "3600"))
+        )
+        
+        # Only near-deterministic calls (e.g. intent routing) are worth replaying from the cache
+        self.cache_enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.cache_max_temperature = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+        
+        # Similar messages reuse an earlier classification for the price of an embedding call
+        self.intent_cache_enabled = os.getenv("INTENT_CACHE_ENABLED", "true").lower() == "true"
+        self.embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+        self.intent_cache = SemanticIntentCache(
+            threshold=float(os.getenv("INTENT_CACHE_THRESHOLD", "0.92")),
+            max_entries=int(os.getenv("INTENT_CACHE_SIZE", "10000"))
+        )
+        self.intent_cache_path = os.getenv("INTENT_CACHE_PATH")
+        
+        # Embeddings persist across restarts so repeated messages never pay for the embedding call twice
+        embedding_cache_dir = os.getenv("EMBEDDING_CACHE_DIR", "/tmp/emb_cache")
+        self.embedding_store = diskcache.Cache(embedding_cache_dir) if self.intent_cache_enabled and embedding_cache_dir else None
+        self.intent_cache_save_every = int(os.getenv("INTENT_CACHE_SAVE_EVERY", "50"))
+        self._intent_cache_unsaved = 0
+        self._background_tasks = set()
+        self._history_contexts: "OrderedDict[int, Tuple[Message, str]]" = OrderedDict()
+        self._classify_batcher = _ClassifyBatcher(
+            self,
+            max_batch=int(os.getenv("INTENT_BATCH_SIZE", "8")),
+            window=float(os.getenv("INTENT_BATCH_WINDOW_MS", "20")) / 1000
+        )
+        if self.intent_cache_path and os.path.exists(self.intent_cache_path):
+            try:
+                self.intent_cache.load(self.intent_cache_path)
+                logger.info(f"Loaded {len(self.intent_cache)} cached intents from {self.intent_cache_path}")
+            except Exception as e:
+                logger.warning(f"Failed to load intent cache from {self.intent_cache_path}: {e}")
     
-    @traceable(name="llm_completion")
+    @sampled_traceable(name="llm_completion")
     async def get_completion(
         self, 
         messages: List[Dict[str, str]], 
         system_prompt: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: int = 1000,
-        run_name: Optional[str] = None
+        run_name: Optional[str] = None,
+        prompt_cache_key: Optional[str] = None,
+        response_format: Optional[Dict[str, Any]] = None
     ) -> str:
         """Get completion from OpenAI with LangSmith tracing"""
         try:
-            # Prepare messages
-            formatted_messages = []
-            
-            if system_prompt:
-                formatted_messages.append({"role": "system", "content": system_prompt})
+            # Prepare messages; the client does not mutate them, so reuse the caller's list when possible
+            formatted_messages = [{"role": "system", "content": system_prompt}, *messages] if system_prompt else messages
             
-            formatted_messages.extend(messages)
+            # Repeated low-temperature prompts are answered from the cache without an upstream call
+            cache_key = None
+            if self.cache_enabled and temperature <= self.cache_max_temperature:
+                cache_key = ResponseCache.make_key(self.model, formatted_messages, temperature, max_tokens, response_format)
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    return cached
             
             # Get completion with optional run name for tracing
             completion_kwargs = {
@@ -51,13 +502,25 @@ class LLMService:
                 "max_tokens": max_tokens
             }
             
+            if response_format:
+                completion_kwargs["response_format"] = response_format
+            
             # Add metadata for LangSmith if available
             if self.langsmith_client and run_name:
                 completion_kwargs["extra_headers"] = {"run_name": run_name}
             
-            response = await self.client.chat.completions.create(**completion_kwargs)
+            # Route requests sharing a prefix to the same prompt cache
+            if prompt_cache_key:
+                completion_kwargs["extra_body"] = {"prompt_cache_key": prompt_cache_key}
+            
+            response = await self.pool.create_chat_completion(**completion_kwargs)
             
-            result = response.choices[0].message.content.strip()
+            # Structured output is exact JSON; only free text needs trimming
+            result = response.choices[0].message.content
+            if not response_format:
+                result = result.strip()
+            if cache_key is not None:
+                self.response_cache.put(cache_key, result)
             
             # Log to LangSmith if enabled
             if self.langsmith_client:
@@ -68,83 +531,197 @@ class LLMService:
         except Exception as e:
             logger.error(f"LLM completion error: {e}")
             
-            # Log error to LangSmith if enabled
+            # Log error to LangSmith if enabled, without holding up the reply
             if self.langsmith_client:
-                try:
-                    self.langsmith_client.create_run(
-                        name="llm_completion_error",
-                        run_type="llm",
-                        inputs={"messages": messages, "system_prompt": system_prompt},
-                        error=str(e)
-                    )
-                except Exception as trace_error:
-                    logger.warning(f"Failed to trace error to LangSmith: {trace_error}")
+                self._spawn(self._trace_error(messages, system_prompt, str(e)))
             
             return f"I apologize, but I'm having trouble processing your request right now. Error: {str(e)}"
     
-    @traceable(name="intent_classification")
+    async def stream_completion(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """Yield completion text as it streams in; closing the generator early closes the HTTP response"""
+        formatted_messages = [{"role": "system", "content": system_prompt}, *messages] if system_prompt else messages
+        completion_kwargs = {
+            "model": self.model,
+            "messages": formatted_messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        if response_format:
+            completion_kwargs["response_format"] = response_format
+        
+        stream = await self.pool.create_chat_completion(**completion_kwargs)
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # LangSmith-wrapped streams are async generators; raw OpenAI streams only expose their response
+            close = getattr(stream, "aclose", None)
+            await (close() if close is not None else stream.response.aclose())
+    
+    def _history_context(self, conversation_history: List[Message]) -> str:
+        """Last 5 messages as "sender: content" lines, reused while the conversation has not moved on"""
+        if not conversation_history:
+            return ""
+        
+        key = id(conversation_history)
+        last = conversation_history[-1]
+        cached = self._history_contexts.get(key)
+        if cached is not None and cached[0] is last:
+            self._history_contexts.move_to_end(key)
+            return cached[1]
+        
+        history_context = "\n".join(f"{msg.sender}: {msg.content}" for msg in conversation_history[-5:])
+        self._history_contexts[key] = (last, history_context)
+        self._history_contexts.move_to_end(key)
+        if len(self._history_contexts) > 256:
+            self._history_contexts.popitem(last=False)
+        return history_context
+    
+    def _classify_by_keywords(self, message: str) -> Optional[AgentIntent]:
+        """Route on weighted domain keywords when the score is decisive, else return None"""
+        scores = {"helios": 0.0, "ceres": 0.0}
+        for match in _KEYWORD_PATTERN.finditer(message.lower()):
+            agent, weight = _KEYWORD_WEIGHTS[match.group(0)]
+            scores[agent] += weight
+        
+        best, runner_up = sorted(scores, key=scores.get, reverse=True)
+        best_score, other_score = scores[best], scores[runner_up]
+        total = best_score + other_score
+        
+        if total == 0:
+            if len(message.strip()) < _SHORT_MESSAGE_CHARS:
+                return AgentIntent(agent="general", confidence=0.7, reasoning="short message without domain keywords")
+            return None
+        
+        single_domain = other_score == 0 and best_score >= _KEYWORD_MIN_SCORE
+        dominant = best_score >= _KEYWORD_DOMINANT_SCORE and best_score >= 2 * other_score
+        if not (single_domain or dominant):
+            return None
+        
+        # Confidence grows with keyword weight and shrinks with the competing domain's share
+        confidence = min(0.95, 0.7 + 0.1 * best_score) * best_score / total
+        return AgentIntent(
+            agent=best,
+            confidence=round(confidence, 3),
+            reasoning="keyword",
+            extracted_params={"keyword_scores": scores}
+        )
+    
+    def _spawn(self, coro) -> None:
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _trace_error(self, messages: List[Dict[str, str]], system_prompt: Optional[str], error: str) -> None:
+        """Record a failed completion in LangSmith from a worker thread"""
+        try:
+            await asyncio.to_thread(
+                self.langsmith_client.create_run,
+                name="llm_completion_error",
+                run_type="llm",
+                inputs={"messages": messages, "system_prompt": system_prompt},
+                error=error
+            )
+        except Exception as trace_error:
+            logger.warning(f"Failed to trace error to LangSmith: {trace_error}")
+    
+    async def close(self) -> None:
+        """Wait for background work and close the shared HTTP connection pool"""
+        await self._classify_batcher.close()
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        if self.embedding_store is not None:
+            self.embedding_store.close()
+        await _http_client.aclose()
+    
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed text for the intent cache, from the on-disk store when seen before; None if the call fails"""
+        key = hashlib.blake2b(f"{self.embedding_model}\0{text}".encode(), digest_size=16).hexdigest()
+        if self.embedding_store is not None:
+            try:
+                stored = await asyncio.to_thread(self.embedding_store.get, key)
+                if stored is not None:
+                    return np.frombuffer(stored, dtype=np.float16)
+            except Exception as e:
+                logger.warning(f"Embedding store read error: {e}")
+        
+        try:
+            response = await self.client.embeddings.create(model=self.embedding_model, input=text)
+        except Exception as e:
+            logger.warning(f"Embedding error, skipping intent cache: {e}")
+            return None
+        
+        # Half precision halves the footprint at negligible cost to cosine similarity
+        embedding = np.asarray(response.data[0].embedding, dtype=np.float16)
+        if self.embedding_store is not None:
+            self._spawn(self._store_embedding(key, embedding.tobytes()))
+        return embedding
+    
+    async def _store_embedding(self, key: str, value: bytes) -> None:
+        """Persist an embedding off the event loop"""
+        try:
+            await asyncio.to_thread(self.embedding_store.set, key, value)
+        except Exception as e:
+            logger.warning(f"Embedding store write error: {e}")
+    
+    def _remember_intent(self, embedding: np.ndarray, intent: AgentIntent) -> None:
+        """Add a classification to the intent cache and periodically persist it"""
+        self.intent_cache.add(embedding, intent)
+        if not self.intent_cache_path:
+            return
+        
+        self._intent_cache_unsaved += 1
+        if self._intent_cache_unsaved >= self.intent_cache_save_every:
+            self._intent_cache_unsaved = 0
+            self._spawn(self._save_intent_cache())
+    
+    async def _save_intent_cache(self) -> None:
+        """Write a snapshot of the intent cache to disk off the event loop"""
+        try:
+            snapshot = self.intent_cache.export()
+            tmp_path = f"{self.intent_cache_path}.tmp.npz"
+            await asyncio.to_thread(np.savez, tmp_path, **snapshot)
+            os.replace(tmp_path, self.intent_cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to save intent cache to {self.intent_cache_path}: {e}")
+    
     async def classify_intent(
         self, 
         message: str, 
         conversation_history: List[Message],
         available_agents: List[str]
     ) -> AgentIntent:
-        """Classify user intent and route to appropriate agent with LangSmith tracing"""
-        
-        # Build context from conversation history
-        history_context = ""
-        if conversation_history:
-            recent_messages = conversation_history[-5:]  # Last 5 messages
-            for msg in recent_messages:
-                history_context += f"{msg.sender}: {msg.content}\n"
-        
-        classification_prompt = f"""
-        You are a message router for a multi-agent system. Analyze the user's message and determine which agent should handle it.
-
-        Available agents:
-        - helios: Handles fitness, workouts, exercise, training, gym activities, physical health, sports
-        - ceres: Handles nutrition, food, meals, diet, recipes, cooking, eating habits, dietary advice
-        - general: For greetings, general questions, chitchat, or unclear requests
-
-        Recent conversation context:
-        {history_context}
-
-        User message: "{message}"
-
-        Respond with a JSON object containing:
-        {{
-            "agent": "agent_name",
-            "confidence": 0.8,
-            "reasoning": "explanation of why this agent was chosen",
-            "extracted_params": {{"param": "value"}}
-        }}
-
-        Rules:
-        - Route fitness/exercise/workout questions to helios
-        - Route food/nutrition/diet questions to ceres  
-        - Route greetings and general chat to general
-        - If uncertain, use general with lower confidence
-        - Confidence should be 0.0-1.0
-        """
+        """Classify user intent and route to appropriate agent (not traced; completions are sampled)"""
+        
+        keyword_intent = self._classify_by_keywords(message)
+        if keyword_intent is not None:
+            return keyword_intent
+        
+        embedding = None
+        if self.intent_cache_enabled:
+            embedding = await self._embed(message)
+            if embedding is not None:
+                cached = self.intent_cache.lookup(embedding)
+                if cached is not None:
+                    return cached
+        
+        history_context = self._history_context(conversation_history)
         
         try:
-            response = await self.get_completion(
-                messages=[{"role": "user", "content": message}],
-                system_prompt=classification_prompt,
-                temperature=0.3,
-                max_tokens=200,
-                run_name="intent_classification"
-            )
-            
-            # Parse JSON response
-            intent_data = json.loads(response)
-            
-            return AgentIntent(
-                agent=intent_data.get("agent", "general"),
-                confidence=float(intent_data.get("confidence", 0.5)),
-                reasoning=intent_data.get("reasoning", "Default routing"),
-                extracted_params=intent_data.get("extracted_params", {})
-            )
+            intent = await self._classify_batcher.classify(message, history_context)
+            if embedding is not None:
+                self._remember_intent(embedding, intent)
+            return intent
             
         except Exception as e:
             logger.error(f"Intent classification error: {e}")
@@ -152,4 +729,103 @@ class LLMService:
                 agent="general",
                 confidence=0.3,
                 reasoning=f"Error in classification: {str(e)}"
-            )
\ No newline at end of file
+            )
+    
+    async def _classify_single(self, message: str, history_context: str) -> AgentIntent:
+        """Classify one message with the static routing prompt"""
+        # Volatile context goes in the user turn so the system prompt stays byte-identical for prefix caching
+        user_content = f"Recent conversation context:\n{history_context}\nUser message: \"{message}\""
+        found: Dict[int, AgentIntent] = {}
+        response = await self._stream_intents(
+            user_content, _CLASSIFY_SYSTEM_PROMPT, 200, _INTENT_RESPONSE_FORMAT, _STREAMED_INTENT, 1, found.__setitem__
+        )
+        if 0 in found:
+            return found[0]
+        
+        return _intent_from_data(_parse_classifier_json(response))
+    
+    async def _classify_batch(self, items: List[Tuple[str, str]], resolve: Callable[[int, AgentIntent], None]) -> None:
+        """Classify several messages with one completion, resolving each by index as it streams in"""
+        batch = [
+            {"id": index, "message": message, "context": history_context}
+            for index, (message, history_context) in enumerate(items)
+        ]
+        resolved = set()
+        
+        def resolve_once(index: int, intent: AgentIntent):
+            if 0 <= index < len(items) and index not in resolved:
+                resolved.add(index)
+                resolve(index, intent)
+        
+        response = await self._stream_intents(
+            orjson.dumps(batch).decode(), _CLASSIFY_BATCH_PROMPT, 200 * len(items), _INTENT_BATCH_RESPONSE_FORMAT,
+            _STREAMED_BATCH_INTENT, len(items), resolve_once
+        )
+        if len(resolved) == len(items):
+            return
+        
+        # The stream ran to completion without matching every entry; fall back to parsing it whole
+        results = _parse_classifier_json(response)
+        if isinstance(results, dict):
+            results = results.get("results", [])
+        for intent_data in results:
+            index = intent_data.get("id")
+            if isinstance(index, int):
+                resolve_once(index, _intent_from_data(intent_data))
+    
+    async def _stream_intents(
+        self,
+        user_content: str,
+        system_prompt: str,
+        max_tokens: int,
+        response_format: Dict[str, Any],
+        pattern: "re.Pattern[str]",
+        expected: int,
+        on_intent: Callable[[int, AgentIntent], None]
+    ) -> str:
+        """Stream a classifier completion, reporting each intent once its agent and confidence are complete; stops after `expected` intents"""
+        temperature = 0.3
+        text = ""
+        position = 0
+        found = 0
+        
+        def report(upto: str) -> None:
+            nonlocal position, found
+            for match in pattern.finditer(upto, position):
+                position = match.end()
+                index = int(match.groupdict().get("id") or 0)
+                confidence = min(max(float(match.group("confidence")), 0.0), 1.0)
+                on_intent(index, AgentIntent(
+                    agent=match.group("agent"),
+                    confidence=confidence,
+                    reasoning="Streamed classification"
+                ))
+                found += 1
+        
+        # A repeated classification replays the text of the earlier stream instead of calling upstream
+        cache_key = None
+        if self.cache_enabled and temperature <= self.cache_max_temperature:
+            cache_key = ResponseCache.make_key(self.model, system_prompt, user_content, temperature, max_tokens, response_format)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                report(cached)
+                return cached
+        
+        stream = self.stream_completion(
+            messages=[{"role": "user", "content": user_content}],
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=response_format
+        )
+        try:
+            async for delta in stream:
+                text += delta
+                report(text)
+                if found >= expected:
+                    break
+        finally:
+            await stream.aclose()
+        if cache_key is not None:
+            self.response_cache.put(cache_key, text)
+        return text
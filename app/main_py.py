@@ -3,11 +3,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 import asyncio
-import json
 import logging
 import os
+import orjson
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from dotenv import load_dotenv
 from langsmith import traceable
 
@@ -15,12 +15,15 @@ from langsmith import traceable
 load_dotenv()
 
 # Import our modules
-from .models import UserSession, Message, MessageType, WebSocketMessage
+from .models import Message, MessageType, AgentIntent
 from .llm_service import LLMService
 from .file_service import FileService
-from .router import MessageRouter
-from .agents import HeliosAgent, CeresAgent, GeneralAgent
+from .router import MessageRouter, AGENT_DISPLAY_NAMES, is_low_entropy
+from .agents import BaseAgent, HeliosAgent, CeresAgent, GeneralAgent
 from .external_bridge import ExternalWebSocketBridge
+from .langsmith_config import get_langsmith_config
+from .clock import now_iso
+from .session_store import SessionStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -48,57 +51,143 @@ helios = HeliosAgent(file_service, llm_service)
 ceres = CeresAgent(file_service, llm_service)
 general_agent = GeneralAgent(file_service, llm_service)
 
-# Session storage
-sessions: Dict[str, UserSession] = {}
+# Routed agent key -> agent; unknown keys fall back to the general assistant
+AGENTS: Dict[str, BaseAgent] = {
+    "helios": helios,
+    "ceres": ceres,
+    "general": general_agent
+}
+
+# Session storage: bounded in memory, idle sessions are snapshotted to disk and rehydrated on return
+sessions = SessionStore(
+    file_service,
+    max_sessions=int(os.getenv("SESSION_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+)
+
+# Routing decision recorded for messages answered by the low-entropy gate
+LOW_ENTROPY_INTENT = AgentIntent(
+    agent="general",
+    confidence=1.0,
+    reasoning="Low-entropy greeting or acknowledgement",
+    display_name=AGENT_DISPLAY_NAMES["general"]
+)
 
 # External WebSocket bridge
 external_bridge: ExternalWebSocketBridge = None
 
+def _pack(message_type: str, message: str, agent: str, timestamp: str = None) -> str:
+    """Serialize an outbound frame with the same fields as WebSocketMessage, skipping pydantic"""
+    return orjson.dumps({
+        "type": message_type,
+        "message": message,
+        "agent": agent,
+        "timestamp": timestamp or now_iso(),
+        "user_id": None,
+        "metadata": None
+    }).decode()
+
+_TIMESTAMP_SLOT = "__timestamp__"
+
+def _template(message_type: str, message: str, agent: str) -> Tuple[str, str]:
+    """Serialize a fixed frame once, split around its timestamp so sending it is a string concatenation"""
+    head, tail = _pack(message_type, message, agent, _TIMESTAMP_SLOT).split(_TIMESTAMP_SLOT)
+    return head, tail
+
+# Static frames sent on connect and on bad input
+WELCOME_FRAME = _template(
+    "message",
+    "🤖 Welcome! I'm your multi-agent assistant. I have specialists in fitness (Helios 💪) and nutrition (Ceres 🥗). How can I help you today?",
+    "System"
+)
+INVALID_JSON_FRAME = _template("message", "Please send valid JSON messages.", "System")
+PROCESSING_ERROR_FRAME = _template(
+    "message",
+    "Sorry, I encountered an error processing your message. Please try again.",
+    "System"
+)
+
 class ConnectionManager:
     """Manage WebSocket connections"""
     
-    def __init__(self):
+    def __init__(self, queue_size: int = 64):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Each connection gets an outbound queue drained by its own relay task, so slow clients never block senders
+        self.queue_size = queue_size
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
     
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
+        self._stop_relay(user_id)
         self.active_connections[user_id] = websocket
+        self.queues[user_id] = queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks[user_id] = asyncio.create_task(self._relay(user_id, websocket, queue))
         logger.info(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
     
     def disconnect(self, user_id: str):
         if user_id in self.active_connections:
             del self.active_connections[user_id]
+        self._stop_relay(user_id)
         logger.info(f"User {user_id} disconnected. Total connections: {len(self.active_connections)}")
     
-    async def send_personal_message(self, message: str, user_id: str, agent: str = "System"):
-        if user_id in self.active_connections:
-            websocket = self.active_connections[user_id]
+    def _stop_relay(self, user_id: str):
+        """Drop a connection's queue and cancel its relay task"""
+        self.queues.pop(user_id, None)
+        task = self.tasks.pop(user_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+    
+    async def _relay(self, user_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        """Write queued frames to one client"""
+        # Hand the ASGI message straight to WebSocket.send, skipping the send_text wrapper.
+        # Frames stay text: the browser clients JSON.parse event.data, which binary frames would turn into Blobs
+        send = websocket.send
+        while True:
+            payload = await queue.get()
             try:
-                response = WebSocketMessage(
-                    type="message",
-                    message=message,
-                    agent=agent,
-                    timestamp=datetime.now().isoformat()
-                )
-                await websocket.send_text(response.model_dump_json())
+                await send({"type": "websocket.send", "text": payload})
             except Exception as e:
                 logger.error(f"Error sending message to {user_id}: {e}")
-                self.disconnect(user_id)
+                if self.active_connections.get(user_id) is websocket:
+                    self.disconnect(user_id)
+                return
+    
+    def _enqueue(self, user_id: str, payload: str):
+        """Queue a frame for a connected client"""
+        queue = self.queues.get(user_id)
+        if queue is not None:
+            self._put(user_id, queue, payload)
+    
+    @staticmethod
+    def _put(user_id: str, queue: asyncio.Queue, payload: str):
+        """Add a frame to a client's queue, dropping its oldest pending frame if it has fallen behind"""
+        if queue.full():
+            queue.get_nowait()
+            logger.warning(f"Outbound queue full for {user_id}, dropped oldest message")
+        queue.put_nowait(payload)
+    
+    async def send_personal_message(self, message: str, user_id: str, agent: str = "System"):
+        if user_id in self.active_connections:
+            self._enqueue(user_id, _pack("message", message, agent))
+    
+    async def send_template(self, template: Tuple[str, str], user_id: str):
+        """Send a pre-serialized frame, stamped with the current time"""
+        if user_id in self.active_connections:
+            self._enqueue(user_id, now_iso().join(template))
     
     async def broadcast(self, message: str, sender: str = "System"):
         """Send message to all connected users"""
-        for user_id, websocket in list(self.active_connections.items()):
-            try:
-                response = WebSocketMessage(
-                    type="broadcast",
-                    message=message,
-                    agent=sender,
-                    timestamp=datetime.now().isoformat()
-                )
-                await websocket.send_text(response.model_dump_json())
-            except Exception as e:
-                logger.error(f"Error broadcasting to {user_id}: {e}")
-                self.disconnect(user_id)
+        if not self.queues:
+            return
+        
+        # Serialize once; every client receives the same frame
+        payload = _pack("broadcast", message, sender)
+        
+        # Enqueueing never mutates the connection maps (dead sockets are dropped by their relay task),
+        # so the queues can be walked in place without snapshotting them
+        for user_id, queue in self.queues.items():
+            self._put(user_id, queue, payload)
 
 manager = ConnectionManager()
 
@@ -110,8 +199,19 @@ async def process_external_message(message_content: str, sender: str, message_ty
         external_user_id = "external-socket-user"
         
         # Ensure external user session exists
-        if external_user_id not in sessions:
-            sessions[external_user_id] = UserSession(user_id=external_user_id)
+        session = await sessions.get(external_user_id)
+        
+        # Route on the history before this turn so the classifier prompt's context prefix is stable;
+        # greetings and acknowledgements skip routing and get a canned reply
+        if is_low_entropy(message_content):
+            intent = LOW_ENTROPY_INTENT
+        else:
+            intent = await router.route_message(
+                message_content,
+                session.conversation_history
+            )
+            
+            logger.info(f"Routing external message to {intent.agent} (confidence: {intent.confidence})")
         
         # Add incoming message to conversation history
         incoming_msg = Message(
@@ -119,32 +219,17 @@ async def process_external_message(message_content: str, sender: str, message_ty
             sender=sender,
             message_type=MessageType.EXTERNAL
         )
-        sessions[external_user_id].conversation_history.append(incoming_msg)
-        
-        # Route message to appropriate agent
-        intent = await router.route_message(
-            message_content,
-            sessions[external_user_id].conversation_history
-        )
-        
-        logger.info(f"Routing external message to {intent.agent} (confidence: {intent.confidence})")
+        session.add_message(incoming_msg)
         
         # Get response from the appropriate agent
-        if intent.agent == "helios":
-            response = await helios.process_message(
-                external_user_id, message_content, sessions[external_user_id].conversation_history
-            )
-            agent_name = "Helios 💪"
-        elif intent.agent == "ceres":
-            response = await ceres.process_message(
-                external_user_id, message_content, sessions[external_user_id].conversation_history
-            )
-            agent_name = "Ceres 🥗"
+        agent_name = intent.display_name
+        if intent is LOW_ENTROPY_INTENT:
+            response = general_agent.quick_reply(message_content)
         else:
-            response = await general_agent.process_message(
-                external_user_id, message_content, sessions[external_user_id].conversation_history
+            agent = AGENTS.get(intent.agent, general_agent)
+            response = await agent.process_message(
+                external_user_id, message_content, session.conversation_history
             )
-            agent_name = "Assistant 🤖"
         
         # Add agent response to conversation history
         agent_msg = Message(
@@ -152,39 +237,49 @@ async def process_external_message(message_content: str, sender: str, message_ty
             sender=intent.agent,
             message_type=MessageType.AGENT
         )
-        sessions[external_user_id].conversation_history.append(agent_msg)
+        session.add_message(agent_msg)
         
         # Send response back to external WebSocket
         if external_bridge:
             await external_bridge.send_to_external(response, agent_name)
         
-        # Log the interaction
-        await file_service.log_to_file(
+        # Log the interaction (queued; written by the file service's background writer)
+        file_service.log_nowait(
             external_user_id,
             "external_conversations.md",
             f"[{sender}]: {message_content}\n[{agent_name}]: {response}"
         )
         
         # Broadcast to local connections that external conversation happened
-        await manager.broadcast(
-            f"External conversation: {sender} asked about {intent.agent} domain",
-            "External Monitor"
-        )
+        if manager.active_connections:
+            await manager.broadcast(
+                f"External conversation: {sender} asked about {intent.agent} domain",
+                "External Monitor"
+            )
         
     except Exception as e:
         logger.error(f"Error processing external message: {e}")
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize external WebSocket connection on startup"""
+    """Start the session evictor and initialize external WebSocket connection on startup"""
     global external_bridge
     
+    sessions.start()
+    
     external_url = os.getenv("EXTERNAL_WS_URL")
     if external_url:
         external_user_id = os.getenv("EXTERNAL_WS_USER_ID", "poc-backend")
+        external_format = os.getenv("EXTERNAL_WS_FORMAT", "json").lower()
+        epoch_timestamps = os.getenv("EXTERNAL_WS_EPOCH_TIMESTAMPS", "false").lower() == "true"
         
         logger.info(f"Setting up external WebSocket bridge to: {external_url}")
-        external_bridge = ExternalWebSocketBridge(external_url, external_user_id)
+        external_bridge = ExternalWebSocketBridge(
+            external_url,
+            external_user_id,
+            wire_format=external_format,
+            epoch_timestamps=epoch_timestamps
+        )
         
         # Add our message processor as a handler
         external_bridge.add_message_handler(process_external_message)
@@ -200,10 +295,15 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Clean up external connections on shutdown"""
+    """Clean up external connections, flush sessions, pending user data and traces, and close LLM connections on shutdown"""
     global external_bridge
     if external_bridge:
         await external_bridge.disconnect()
+    
+    await sessions.close()
+    await file_service.close()
+    await llm_service.close()
+    await get_langsmith_config().close()
 
 # REST API Endpoints
 
@@ -218,7 +318,7 @@ async def health_check():
     
     return {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": now_iso(),
         "active_sessions": len(sessions),
         "active_connections": len(manager.active_connections),
         "external_bridge": external_status,
@@ -289,15 +389,10 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await manager.connect(websocket, user_id)
     
     # Initialize user session
-    if user_id not in sessions:
-        sessions[user_id] = UserSession(user_id=user_id)
+    await sessions.get(user_id)
     
     # Send welcome message
-    await manager.send_personal_message(
-        "🤖 Welcome! I'm your multi-agent assistant. I have specialists in fitness (Helios 💪) and nutrition (Ceres 🥗). How can I help you today?",
-        user_id,
-        "System"
-    )
+    await manager.send_template(WELCOME_FRAME, user_id)
     
     try:
         while True:
@@ -306,7 +401,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             
             try:
                 # Parse incoming message
-                message_data = json.loads(data)
+                message_data = orjson.loads(data)
                 user_message = message_data.get("message", "").strip()
                 
                 if not user_message:
@@ -314,8 +409,21 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                 
                 logger.info(f"Received from {user_id}: {user_message}")
                 
-                # Update session activity
-                sessions[user_id].last_activity = datetime.now()
+                # Update session activity (rehydrates the session if it was evicted while idle)
+                session = await sessions.get(user_id)
+                session.last_activity = datetime.now()
+                
+                # Route on the history before this turn so the classifier prompt's context prefix is stable;
+                # greetings and acknowledgements skip routing and get a canned reply
+                if is_low_entropy(user_message):
+                    intent = LOW_ENTROPY_INTENT
+                else:
+                    intent = await router.route_message(
+                        user_message,
+                        session.conversation_history
+                    )
+                    
+                    logger.info(f"Routing to {intent.agent} (confidence: {intent.confidence})")
                 
                 # Add user message to conversation history
                 user_msg = Message(
@@ -323,39 +431,17 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                     sender=user_id,
                     message_type=MessageType.USER
                 )
-                sessions[user_id].conversation_history.append(user_msg)
-                
-                # Route message to appropriate agent
-                intent = await router.route_message(
-                    user_message,
-                    sessions[user_id].conversation_history
-                )
-                
-                logger.info(f"Routing to {intent.agent} (confidence: {intent.confidence})")
-                
-                # Send typing indicator
-                await manager.send_personal_message(
-                    f"{intent.agent.title()} is thinking...",
-                    user_id,
-                    "System"
-                )
+                session.add_message(user_msg)
                 
                 # Get response from appropriate agent
-                if intent.agent == "helios":
-                    response = await helios.process_message(
-                        user_id, user_message, sessions[user_id].conversation_history
-                    )
-                    agent_name = "Helios 💪"
-                elif intent.agent == "ceres":
-                    response = await ceres.process_message(
-                        user_id, user_message, sessions[user_id].conversation_history
-                    )
-                    agent_name = "Ceres 🥗"
+                agent_name = intent.display_name
+                if intent is LOW_ENTROPY_INTENT:
+                    response = general_agent.quick_reply(user_message)
                 else:
-                    response = await general_agent.process_message(
-                        user_id, user_message, sessions[user_id].conversation_history
+                    agent = AGENTS.get(intent.agent, general_agent)
+                    response = await agent.process_message(
+                        user_id, user_message, session.conversation_history
                     )
-                    agent_name = "Assistant 🤖"
                 
                 # Add agent response to conversation history
                 agent_msg = Message(
@@ -363,31 +449,23 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                     sender=intent.agent,
                     message_type=MessageType.AGENT
                 )
-                sessions[user_id].conversation_history.append(agent_msg)
+                session.add_message(agent_msg)
                 
                 # Send response to user
                 await manager.send_personal_message(response, user_id, agent_name)
                 
-                # Log conversation
-                await file_service.log_to_file(
+                # Log conversation (queued; written by the file service's background writer)
+                file_service.log_nowait(
                     user_id,
                     "conversations.md",
                     f"User: {user_message}\n{agent_name}: {response}"
                 )
                 
-            except json.JSONDecodeError:
-                await manager.send_personal_message(
-                    "Please send valid JSON messages.",
-                    user_id,
-                    "System"
-                )
+            except orjson.JSONDecodeError:
+                await manager.send_template(INVALID_JSON_FRAME, user_id)
             except Exception as e:
                 logger.error(f"Error processing message from {user_id}: {e}")
-                await manager.send_personal_message(
-                    "Sorry, I encountered an error processing your message. Please try again.",
-                    user_id,
-                    "System"
-                )
+                await manager.send_template(PROCESSING_ERROR_FRAME, user_id)
                 
     except WebSocketDisconnect:
         manager.disconnect(user_id)
@@ -395,4 +473,5 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop and httptools ship with uvicorn[standard]
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import ClassVar, List, Optional, Dict, Any
 from enum import Enum
 from datetime import datetime
 
@@ -21,8 +21,13 @@ class AgentIntent(BaseModel):
     confidence: float = Field(ge=0.0, le=1.0)
     reasoning: str
     extracted_params: Optional[Dict[str, Any]] = None
+    display_name: Optional[str] = None
 
 class UserSession(BaseModel):
+    # Turns kept verbatim; older ones are folded into session_data["summary"]
+    MAX_TURNS: ClassVar[int] = 40
+    SUMMARY_MAX_CHARS: ClassVar[int] = 2000
+    
     user_id: str
     conversation_history: List[Message] = Field(default_factory=list)
     active_agent: Optional[str] = None
@@ -32,6 +37,21 @@ class UserSession(BaseModel):
 
     class Config:
         arbitrary_types_allowed = True
+    
+    def add_message(self, message: Message) -> None:
+        """Append a message, moving turns beyond MAX_TURNS into a rolling summary"""
+        self.conversation_history.append(message)
+        overflow = len(self.conversation_history) - self.MAX_TURNS
+        if overflow <= 0:
+            return
+        
+        # Trim in place so callers holding the list keep seeing the live history
+        evicted = self.conversation_history[:overflow]
+        del self.conversation_history[:overflow]
+        
+        lines = [f"{msg.sender}: {msg.content[:200]}" for msg in evicted]
+        summary = "\n".join([self.session_data["summary"], *lines]) if self.session_data.get("summary") else "\n".join(lines)
+        self.session_data["summary"] = summary[-self.SUMMARY_MAX_CHARS:]
 
 class WebSocketMessage(BaseModel):
     type: str = "message"
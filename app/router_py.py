@@ -1,63 +1,174 @@
-from typing import List
+from collections import OrderedDict
+from typing import FrozenSet, List, Optional, Tuple
 import logging
+import re
+import time
 from langsmith import traceable
-from .models import Message, AgentIntent
+from .models import Message, MessageType, AgentIntent
 from .llm_service import LLMService
 
 logger = logging.getLogger(__name__)
 
+# Fitness keywords
+FITNESS_KEYWORDS = frozenset([
+    "workout", "exercise", "gym", "fitness", "training", "run", "lift",
+    "cardio", "strength", "muscle", "pushup", "squat", "deadlift",
+    "marathon", "sprint", "yoga", "pilates", "crossfit", "weightlifting"
+])
+
+# Nutrition keywords
+NUTRITION_KEYWORDS = frozenset([
+    "food", "eat", "meal", "diet", "nutrition", "recipe", "cook", "calories",
+    "protein", "carbs", "fat", "vitamins", "hungry", "breakfast", "lunch",
+    "dinner", "snack", "vegetarian", "vegan", "keto", "weight loss"
+])
+
+# Greeting keywords
+GREETING_KEYWORDS = frozenset([
+    "hello", "hi", "hey", "good morning", "good afternoon", "good evening",
+    "how are you", "what's up", "greetings", "yo"
+])
+
+# Acknowledgement phrases (yes/no are left out: they usually answer an agent's question)
+ACKNOWLEDGEMENT_KEYWORDS = frozenset([
+    "ok", "okay", "k", "thanks", "thank you", "thx", "ty", "cool", "nice",
+    "great", "got it", "bye", "cheers"
+])
+
+# Names shown to users for each routed agent
+AGENT_DISPLAY_NAMES = {
+    "helios": "Helios 💪",
+    "ceres": "Ceres 🥗",
+    "general": "Assistant 🤖"
+}
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def _normalize_text(message_lower: str) -> str:
+    """Strip punctuation and collapse whitespace"""
+    return _WHITESPACE_RE.sub(" ", _PUNCTUATION_RE.sub("", message_lower)).strip()
+
+# Whole normalized phrases that carry no routable signal on their own
+_GREETING_PHRASES = frozenset(_normalize_text(phrase) for phrase in GREETING_KEYWORDS)
+_LOW_ENTROPY_PHRASES = _GREETING_PHRASES | frozenset(_normalize_text(phrase) for phrase in ACKNOWLEDGEMENT_KEYWORDS)
+
+def is_low_entropy(message: str) -> bool:
+    """True for a bare greeting or acknowledgement ("thank you!", "good morning"), or two one-word ones ("ok thanks")"""
+    phrase = _normalize_text(message.lower())
+    if phrase in _LOW_ENTROPY_PHRASES:
+        return True
+    tokens = phrase.split()
+    return len(tokens) == 2 and all(token in _LOW_ENTROPY_PHRASES for token in tokens)
+
+def is_greeting(message: str) -> bool:
+    """True when a low-entropy message is (or opens with) a greeting rather than an acknowledgement"""
+    phrase = _normalize_text(message.lower())
+    return phrase in _GREETING_PHRASES or phrase.split(" ", 1)[0] in _GREETING_PHRASES
+
+def _compile_keywords(keywords: FrozenSet[str], inflections: bool = True) -> "re.Pattern[str]":
+    """Whole-word alternation over the keywords, optionally allowing common inflections (runs, running, lifted)"""
+    alternation = "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    suffix = "(?:s|es|ing|ning|ed)?" if inflections else ""
+    return re.compile(rf"\b({alternation}){suffix}\b")
+
 class MessageRouter:
     """Routes messages to appropriate agents based on content analysis"""
     
-    def __init__(self, llm_service: LLMService):
+    def __init__(self, llm_service: LLMService, cache_size: int = 2048, cache_ttl: float = 3600):
         self.llm_service = llm_service
         self.available_agents = ["helios", "ceres", "general"]
+        
+        # Routing decisions memoized by normalized message text and the agent the conversation was last routed to
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._intent_cache: "OrderedDict[Tuple[str, Optional[str]], Tuple[float, AgentIntent]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+        # One C-level scan per category instead of a substring test per keyword
+        self._fitness_re = _compile_keywords(FITNESS_KEYWORDS)
+        self._nutrition_re = _compile_keywords(NUTRITION_KEYWORDS)
+        # Greetings are fixed phrases; an inflection suffix would turn "hi" into "his"
+        self._greeting_re = _compile_keywords(GREETING_KEYWORDS, inflections=False)
     
     @traceable(name="route_message")
     async def route_message(self, message: str, conversation_history: List[Message]) -> AgentIntent:
-        """Analyze message and determine which agent should handle it with LangSmith tracing"""
+        """Analyze message and determine which agent should handle it with LangSmith tracing (history excludes the message)"""
+        
+        # Lowercased once; the cache key and keyword scan both work on this. The LLM classifies with the
+        # conversation as context, so the same words may route differently depending on where it stands
+        message_lower = message.lower()
+        cache_key = (self._normalize(message_lower), self._last_agent(conversation_history))
+        cached = self._cached_intent(cache_key)
+        if cached:
+            self.hits += 1
+            return cached
+        self.misses += 1
         
         # Quick keyword-based routing for efficiency
-        quick_route = self._quick_route(message)
+        quick_route = self._quick_route(message_lower)
         if quick_route:
+            self._set_display_name(quick_route)
             logger.info(f"Quick route successful: {quick_route.agent} (confidence: {quick_route.confidence})")
+            self._cache_intent(cache_key, quick_route)
             return quick_route
         
         # Use LLM for complex routing
         logger.info("Using LLM classification for routing")
-        return await self.llm_service.classify_intent(
+        intent = await self.llm_service.classify_intent(
             message, 
             conversation_history, 
             self.available_agents
         )
+        self._set_display_name(intent)
+        
+        # Failed classifications fall back to general; don't pin that on the message
+        if not intent.reasoning.startswith("Error in classification"):
+            self._cache_intent(cache_key, intent)
+        return intent
+    
+    @staticmethod
+    def _set_display_name(intent: AgentIntent) -> None:
+        """Attach the user-facing agent name, falling back to the general assistant's"""
+        intent.display_name = AGENT_DISPLAY_NAMES.get(intent.agent, AGENT_DISPLAY_NAMES["general"])
+    
+    @staticmethod
+    def _last_agent(conversation_history: List[Message]) -> Optional[str]:
+        """Agent that answered most recently in the conversation, None before any agent reply"""
+        for msg in reversed(conversation_history):
+            if msg.message_type == MessageType.AGENT:
+                return msg.sender
+        return None
+    
+    @staticmethod
+    def _normalize(message_lower: str) -> str:
+        """Strip punctuation and collapse whitespace so trivial variants share a cache entry"""
+        return _normalize_text(message_lower)
+    
+    def _cached_intent(self, key: Tuple[str, Optional[str]]) -> Optional[AgentIntent]:
+        """Return a cached routing decision unless it has expired"""
+        entry = self._intent_cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.cache_ttl:
+            del self._intent_cache[key]
+            return None
+        self._intent_cache.move_to_end(key)
+        return entry[1]
+    
+    def _cache_intent(self, key: Tuple[str, Optional[str]], intent: AgentIntent) -> None:
+        """Store a routing decision, evicting the least recently used entry when full"""
+        self._intent_cache[key] = (time.monotonic(), intent)
+        self._intent_cache.move_to_end(key)
+        if len(self._intent_cache) > self.cache_size:
+            self._intent_cache.popitem(last=False)
     
     @traceable(name="quick_route")
-    def _quick_route(self, message: str) -> AgentIntent:
-        """Fast keyword-based routing for common patterns with tracing"""
-        message_lower = message.lower()
-        
-        # Fitness keywords
-        fitness_keywords = [
-            "workout", "exercise", "gym", "fitness", "training", "run", "lift", 
-            "cardio", "strength", "muscle", "pushup", "squat", "deadlift",
-            "marathon", "sprint", "yoga", "pilates", "crossfit", "weightlifting"
-        ]
-        
-        # Nutrition keywords  
-        nutrition_keywords = [
-            "food", "eat", "meal", "diet", "nutrition", "recipe", "cook", "calories",
-            "protein", "carbs", "fat", "vitamins", "hungry", "breakfast", "lunch", 
-            "dinner", "snack", "vegetarian", "vegan", "keto", "weight loss"
-        ]
-        
-        # Greeting keywords
-        greeting_keywords = [
-            "hello", "hi", "hey", "good morning", "good afternoon", "good evening",
-            "how are you", "what's up", "greetings", "yo"
-        ]
-        
+    def _quick_route(self, message_lower: str) -> AgentIntent:
+        """Fast keyword-based routing for common patterns with tracing (expects lowercased text)"""
         # Check for fitness content
-        fitness_score = sum(1 for keyword in fitness_keywords if keyword in message_lower)
+        fitness_score = self._keyword_score(self._fitness_re, message_lower)
         if fitness_score >= 1:
             return AgentIntent(
                 agent="helios",
@@ -67,7 +178,7 @@ class MessageRouter:
             )
         
         # Check for nutrition content
-        nutrition_score = sum(1 for keyword in nutrition_keywords if keyword in message_lower)
+        nutrition_score = self._keyword_score(self._nutrition_re, message_lower)
         if nutrition_score >= 1:
             return AgentIntent(
                 agent="ceres",
@@ -77,7 +188,7 @@ class MessageRouter:
             )
         
         # Check for greetings
-        greeting_score = sum(1 for keyword in greeting_keywords if keyword in message_lower)
+        greeting_score = self._keyword_score(self._greeting_re, message_lower)
         if greeting_score >= 1:
             return AgentIntent(
                 agent="general",
@@ -89,10 +200,20 @@ class MessageRouter:
         # If no quick match, return None to trigger LLM routing
         return None
     
+    @staticmethod
+    def _keyword_score(pattern: "re.Pattern[str]", message_lower: str) -> int:
+        """Number of distinct keywords from a category found in the message"""
+        return len(set(pattern.findall(message_lower)))
+    
     def get_routing_stats(self) -> dict:
         """Get statistics about routing decisions"""
         return {
             "available_agents": self.available_agents,
             "routing_methods": ["keyword_based", "llm_analysis"],
-            "supported_domains": ["fitness", "nutrition", "general"]
+            "supported_domains": ["fitness", "nutrition", "general"],
+            "cache": {
+                "size": len(self._intent_cache),
+                "hits": self.hits,
+                "misses": self.misses
+            }
         }
\ No newline at end of file
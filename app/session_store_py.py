@@ -0,0 +1,128 @@
+"""
+Session Store
+Keeps recently active user sessions in memory and parks idle ones on disk
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterator, List, Optional
+from .models import UserSession
+from .file_service import FileService
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "session.json"
+
+class SessionStore:
+    """Bounded, TTL-evicting map of user_id -> UserSession backed by per-user snapshots"""
+    
+    def __init__(
+        self,
+        file_service: FileService,
+        max_sessions: int = 10000,
+        ttl: float = 3600.0,
+        sweep_interval: float = 60.0
+    ):
+        self.file_service = file_service
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        
+        # user_id -> [session, last_access], least recently used first
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        self._sweep_task: Optional[asyncio.Task] = None
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+    
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._sessions
+    
+    def values(self) -> Iterator[UserSession]:
+        """Iterate over the sessions currently held in memory"""
+        return (entry[0] for entry in self._sessions.values())
+    
+    async def get(self, user_id: str) -> UserSession:
+        """Return a user's session, rehydrating it from its snapshot or creating it if needed"""
+        entry = self._sessions.get(user_id)
+        if entry is not None:
+            entry[1] = time.monotonic()
+            self._sessions.move_to_end(user_id)
+            return entry[0]
+        
+        session = await self._rehydrate(user_id) or UserSession(user_id=user_id)
+        
+        # Another task may have loaded the same user while we were reading the snapshot
+        entry = self._sessions.get(user_id)
+        if entry is not None:
+            entry[1] = time.monotonic()
+            self._sessions.move_to_end(user_id)
+            return entry[0]
+        
+        self._sessions[user_id] = [session, time.monotonic()]
+        while len(self._sessions) > self.max_sessions:
+            evicted_id, (evicted, _) = self._sessions.popitem(last=False)
+            await self._persist(evicted_id, evicted)
+        return session
+    
+    async def _rehydrate(self, user_id: str) -> Optional[UserSession]:
+        """Rebuild a session from its on-disk snapshot"""
+        data = await self.file_service.load_json(user_id, SNAPSHOT_FILE)
+        if data is None:
+            return None
+        try:
+            return UserSession.model_validate(data)
+        except Exception as e:
+            logger.error(f"Error restoring session for user {user_id}: {e}")
+            return None
+    
+    async def _persist(self, user_id: str, session: UserSession) -> None:
+        """Hand a session snapshot to the file service"""
+        await self.file_service.save_json(user_id, SNAPSHOT_FILE, session.model_dump(mode="json"))
+    
+    async def sweep(self) -> int:
+        """Move sessions idle for longer than the TTL out to disk; returns how many were evicted"""
+        cutoff = time.monotonic() - self.ttl
+        expired: List[str] = []
+        for user_id, (_, last_access) in self._sessions.items():
+            if last_access > cutoff:
+                break
+            expired.append(user_id)
+        
+        for user_id in expired:
+            entry = self._sessions.pop(user_id, None)
+            if entry is None:
+                continue
+            try:
+                await self._persist(user_id, entry[0])
+            except Exception as e:
+                logger.error(f"Error persisting session for user {user_id}: {e}")
+        
+        if expired:
+            logger.info(f"Evicted {len(expired)} idle sessions. Sessions in memory: {len(self._sessions)}")
+        return len(expired)
+    
+    async def _sweep_loop(self):
+        """Periodically evict idle sessions"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+    
+    def start(self) -> None:
+        """Start the background evictor"""
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+    
+    async def close(self) -> None:
+        """Stop the evictor and snapshot every session still in memory"""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        
+        for user_id, (session, _) in list(self._sessions.items()):
+            try:
+                await self._persist(user_id, session)
+            except Exception as e:
+                logger.error(f"Error persisting session for user {user_id}: {e}")
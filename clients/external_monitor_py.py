@@ -8,40 +8,105 @@ import asyncio
 import websockets
 import json
 import sys
+import time
 import os
+import re
 from datetime import datetime
-from typing import Optional
+from typing import Any, List, Optional
+
+try:
+    import orjson
+    
+    _loads = orjson.loads
+    
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+    
+    def _dump_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    _loads = json.loads
+    _dumps = json.dumps
+    
+    def _dump_line(obj: Any) -> bytes:
+        return json.dumps(obj).encode() + b'\n'
+
+# Emojis the backend puts in agent display names (💪 Helios, 🥗 Ceres, 🤖 Assistant)
+_AGENT_EMOJI_RE = re.compile("[\U0001F4AA\U0001F957\U0001F916]")
+
+# First character of a JSON object frame, for text and binary frames
+_JSON_OBJECT_START = ("{", b"{")
+
+# Second-resolution parts of the timestamps, reformatted only when the second changes
+_second_cache = [-1, "", ""]
+
+def _refresh_second(now: float):
+    second = int(now)
+    if second != _second_cache[0]:
+        local = time.localtime(second)
+        _second_cache[0] = second
+        _second_cache[1] = time.strftime("%H:%M:%S", local)
+        _second_cache[2] = time.strftime("%Y-%m-%dT%H:%M:%S", local)
+
+def _clock_time() -> str:
+    """Current local time as HH:MM:SS"""
+    _refresh_second(time.time())
+    return _second_cache[1]
+
+def _iso_now() -> str:
+    """Current local time in ISO 8601 format with microseconds"""
+    now = time.time()
+    _refresh_second(now)
+    return f"{_second_cache[2]}.{int((now % 1) * 1_000_000):06d}"
 
 class ExternalMonitor:
     def __init__(self, url: str, user_id: str = "monitor-client"):
         self.url = url
         self.user_id = user_id
+        
+        # Build connection URL once
+        if "{user_id}" in url:
+            self.connect_url = url.replace("{user_id}", user_id)
+        elif not url.endswith('/ws'):
+            self.connect_url = f"{url.rstrip('/')}/ws/{user_id}"
+        else:
+            self.connect_url = f"{url}/{user_id}"
         self.websocket: Optional[websockets.WebSocketServerProtocol] = None
         self.is_connected = False
         self.message_count = 0
         self.start_time = None
         
+        # Log lines are buffered and written in batches with a single writev
+        self.log_batch_size = 64
+        self.log_flush_interval = 0.1
+        self._log_file = None
+        self._log_buffer: List[bytes] = []
+        self._log_flush_task: Optional[asyncio.Task] = None
+        self._log_wakeup: Optional[asyncio.Event] = None
+        self._log_closing = False
+        
     async def connect_and_monitor(self):
         """Connect to external WebSocket and start monitoring"""
         try:
-            # Build connection URL
-            if "{user_id}" in self.url:
-                connect_url = self.url.replace("{user_id}", self.user_id)
-            elif not self.url.endswith('/ws'):
-                connect_url = f"{self.url.rstrip('/')}/ws/{self.user_id}"
-            else:
-                connect_url = f"{self.url}/{self.user_id}"
-            
+            connect_url = self.connect_url
             print(f"🔗 Connecting to: {connect_url}")
             
             # Connect with timeout
             self.websocket = await asyncio.wait_for(
-                websockets.connect(connect_url, ping_interval=30),
+                websockets.connect(
+                    connect_url,
+                    ping_interval=30,
+                    # No permessage-deflate for small JSON frames; keep the default max_size against an untrusted peer
+                    compression=None,
+                    read_limit=2**20,
+                    write_limit=2**20
+                ),
                 timeout=10
             )
             
             self.is_connected = True
             self.start_time = datetime.now()
+            self._open_log()
             print(f"✅ Connected successfully at {self.start_time.strftime('%H:%M:%S')}")
             
             # Send initial message
@@ -65,10 +130,10 @@ class ExternalMonitor:
                 "type": message_type,
                 "message": content,
                 "from": "monitor-client",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": _iso_now()
             }
             
-            await self.websocket.send(json.dumps(message_data))
+            await self.websocket.send(_dumps(message_data))
             print(f"📤 Sent: {content}")
             return True
             
@@ -98,15 +163,21 @@ class ExternalMonitor:
             self.is_connected = False
             if self.websocket:
                 await self.websocket.close()
+            await self._close_log()
     
     async def process_message(self, raw_message: str):
         """Process and display incoming message"""
         self.message_count += 1
-        timestamp = datetime.now().strftime("%H:%M:%S")
+        timestamp = _clock_time()
+        
+        # Only a frame opening with a brace can be a JSON object; anything else skips the parse attempt
+        if raw_message[:1] not in _JSON_OBJECT_START:
+            print(f"📄 [{timestamp}] Plain text: {raw_message}")
+            return
         
         try:
             # Try to parse as JSON
-            data = json.loads(raw_message)
+            data = _loads(raw_message)
             
             message_type = data.get("type", "unknown")
             sender = data.get("agent", data.get("sender", data.get("from", "Unknown")))
@@ -117,7 +188,7 @@ class ExternalMonitor:
                 print(f"📨 [{timestamp}] {sender}: {content}")
                 
                 # Detect if this looks like an agent response
-                if any(emoji in sender for emoji in ["💪", "🥗", "🤖"]):
+                if _AGENT_EMOJI_RE.search(sender):
                     print(f"   🤖 Agent detected: {sender}")
                     
             elif message_type == "system":
@@ -140,21 +211,72 @@ class ExternalMonitor:
             
             await self.log_to_file(log_entry)
             
-        except json.JSONDecodeError:
+        except ValueError:
             # Handle plain text messages
             print(f"📄 [{timestamp}] Plain text: {raw_message}")
     
+    def _open_log(self):
+        """Open today's log file and start the background writer"""
+        try:
+            log_filename = f"monitor_log_{datetime.now().strftime('%Y%m%d')}.jsonl"
+            self._log_file = open(log_filename, 'ab', buffering=0)
+            self._log_closing = False
+            self._log_wakeup = asyncio.Event()
+            self._log_flush_task = asyncio.create_task(self._log_flush_loop())
+        except Exception as e:
+            print(f"⚠️  Logging error: {e}")
+    
     async def log_to_file(self, log_entry: dict):
         """Log message to file"""
+        if self._log_file is None:
+            return
+        
+        self._log_buffer.append(_dump_line(log_entry))
+        if len(self._log_buffer) >= self.log_batch_size:
+            self._log_wakeup.set()
+    
+    @staticmethod
+    def _write_lines(fd: int, buffers: List[bytes]):
+        """Write log lines with one writev call (runs in a worker thread)"""
+        written = os.writev(fd, buffers)
+        if written < sum(len(buffer) for buffer in buffers):
+            # Short write: finish the remainder with plain writes
+            remaining = memoryview(b''.join(buffers))[written:]
+            while remaining:
+                remaining = remaining[os.write(fd, remaining):]
+    
+    async def _flush_log(self):
+        """Hand all buffered log lines to a worker thread so the read loop never blocks on disk"""
+        if not self._log_buffer:
+            return
+        
+        buffers, self._log_buffer = self._log_buffer, []
         try:
-            log_filename = f"monitor_log_{datetime.now().strftime('%Y%m%d')}.jsonl"
-            
-            with open(log_filename, 'a') as f:
-                f.write(json.dumps(log_entry) + '\n')
-                
+            await asyncio.to_thread(self._write_lines, self._log_file.fileno(), buffers)
         except Exception as e:
             print(f"⚠️  Logging error: {e}")
     
+    async def _log_flush_loop(self):
+        """Single writer: flush when a batch fills up or the interval passes, until the log is closed"""
+        while not self._log_closing:
+            try:
+                await asyncio.wait_for(self._log_wakeup.wait(), timeout=self.log_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._log_wakeup.clear()
+            await self._flush_log()
+    
+    async def _close_log(self):
+        """Let the writer flush what is left, then close the log file"""
+        if self._log_flush_task:
+            self._log_closing = True
+            self._log_wakeup.set()
+            await self._log_flush_task
+            self._log_flush_task = None
+        if self._log_file:
+            self._log_file.close()
+            self._log_file = None
+    
     def print_stats(self):
         """Print connection statistics"""
         if self.start_time:
@@ -256,4 +378,12 @@ async def main():
         monitor.print_stats()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Run on uvloop when it is installed (it has no Windows build)
+    run = asyncio.run
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            run = uvloop.run
+        except ImportError:
+            pass
+    run(main())
\ No newline at end of file
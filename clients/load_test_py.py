@@ -7,34 +7,106 @@ Tests multiple concurrent WebSocket connections
 import asyncio
 import websockets
 import json
+import random
 import time
-import statistics
-from datetime import datetime
-from typing import List, Dict, Any
+import ssl
+import sys
+from array import array
+from collections import deque
+from typing import List, Dict, Any, Optional
+from urllib.parse import urlsplit
 import argparse
+import numpy as np
+
+from websockets.frames import OP_TEXT
+
+try:
+    import orjson
+    
+    _dump_bytes = orjson.dumps
+except ImportError:
+    def _dump_bytes(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+# Rows of the shared message counter array
+SENT, RECEIVED = 0, 1
+
+class ResponseTimeSamples:
+    """Response times kept for percentiles, reservoir-sampled once `capacity` samples are held"""
+    
+    def __init__(self, capacity: int = 1_000_000):
+        self.capacity = capacity
+        self.values = array('d')
+        self.seen = 0
+    
+    def add(self, value: float):
+        self.seen += 1
+        if len(self.values) < self.capacity:
+            self.values.append(value)
+        else:
+            slot = random.randrange(self.seen)
+            if slot < self.capacity:
+                self.values[slot] = value
 
 class LoadTestClient:
-    def __init__(self, client_id: str, server_url: str):
+    def __init__(
+        self,
+        client_id: str,
+        server_url: str,
+        connect_kwargs: Optional[Dict[str, Any]] = None,
+        counters: Optional[np.ndarray] = None,
+        index: int = 0,
+        samples: Optional[ResponseTimeSamples] = None
+    ):
         self.client_id = client_id
         self.server_url = server_url
+        self.ws_url = f"{server_url.rstrip('/')}/ws/{client_id}"
+        self.connect_kwargs = connect_kwargs or {}
         self.websocket = None
         self.connected = False
-        self.messages_sent = 0
-        self.messages_received = 0
-        self.response_times = []
+        # Message counts live in column `index` of a (2, n_clients) array shared by all clients
+        self.counters = counters if counters is not None else np.zeros((2, 1), dtype=np.int64)
+        self.index = index
+        # Running response-time totals; the samples for percentiles are shared across clients
+        self.rt_count = 0
+        self.rt_sum = 0.0
+        self.rt_min = float('inf')
+        self.rt_max = 0.0
+        self.samples = samples if samples is not None else ResponseTimeSamples()
         self.errors = []
         self.start_time = None
         
+        # Pre-serialized frames waiting to go out, drained by one long-lived sender task
+        self.out_queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+        self.send_batch_size = 32
+        self.sender_task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # Send times (loop clock) of messages still waiting for a reply, oldest first
+        self.pending = deque()
+        # Shared cap on outstanding messages; a slot is held from queueing until the reply arrives
+        self.slots: Optional[asyncio.Semaphore] = None
+        
     async def connect(self) -> bool:
         """Connect to WebSocket server"""
         try:
-            ws_url = f"{self.server_url}/ws/{self.client_id}"
             self.websocket = await asyncio.wait_for(
-                websockets.connect(ws_url), 
+                websockets.connect(
+                    self.ws_url,
+                    # Small JSON frames gain nothing from permessage-deflate; bigger buffers mean fewer drains
+                    compression=None,
+                    max_size=None,
+                    max_queue=None,
+                    read_limit=2**20,
+                    write_limit=2**20,
+                    **self.connect_kwargs
+                ),
                 timeout=10
             )
+            # The server greets every new connection; take that frame now so it isn't matched to a send
+            await asyncio.wait_for(self.websocket.recv(), timeout=10)
             self.connected = True
             self.start_time = time.time()
+            self.loop = asyncio.get_running_loop()
             return True
         except Exception as e:
             self.errors.append(f"Connection error: {e}")
@@ -42,53 +114,89 @@ class LoadTestClient:
     
     async def disconnect(self):
         """Disconnect from WebSocket"""
+        if self.sender_task:
+            self.sender_task.cancel()
         if self.websocket:
             await self.websocket.close()
         self.connected = False
     
-    async def send_message(self, content: str) -> float:
-        """Send message and measure response time"""
-        if not self.connected:
-            return -1
-        
-        try:
-            message = {
-                "type": "message",
-                "message": content,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            send_time = time.time()
-            await self.websocket.send(json.dumps(message))
-            self.messages_sent += 1
-            
-            # Wait for response
-            response = await asyncio.wait_for(
-                self.websocket.recv(), 
-                timeout=30
-            )
-            
-            receive_time = time.time()
-            response_time = receive_time - send_time
-            self.response_times.append(response_time)
-            self.messages_received += 1
-            
-            return response_time
+    def start_sender(self):
+        """Start the task that writes queued frames to the socket"""
+        if self.connected and self.sender_task is None:
+            self.sender_task = asyncio.create_task(self._sender())
+    
+    async def _sender(self):
+        """Send queued frames in order, everything already queued going out with a single drain"""
+        while self.connected:
+            frames = [await self.out_queue.get()]
+            while len(frames) < self.send_batch_size and not self.out_queue.empty():
+                frames.append(self.out_queue.get_nowait())
             
-        except Exception as e:
-            self.errors.append(f"Send error: {e}")
-            return -1
+            sent_at = self.loop.time()
+            self.pending.extend([sent_at] * len(frames))
+            try:
+                await self.websocket.ensure_open()
+                # Frames are UTF-8 already, so frame them as text directly instead of going through send(),
+                # which would need a str and encode it again. They must stay text frames: the server reads
+                # with receive_text()
+                for frame in frames:
+                    self.websocket.write_frame_sync(True, OP_TEXT, frame)
+                await self.websocket.drain()
+                self.counters[SENT, self.index] += len(frames)
+            except Exception as e:
+                # The listener may already have consumed (and released) some of this batch from the left
+                for _ in range(min(len(frames), len(self.pending))):
+                    self.pending.pop()
+                    self._release_slot()
+                self.errors.append(f"Send error: {e}")
+    
+    def _record_response_time(self, response_time: float):
+        self.rt_count += 1
+        self.rt_sum += response_time
+        if response_time < self.rt_min:
+            self.rt_min = response_time
+        if response_time > self.rt_max:
+            self.rt_max = response_time
+        self.samples.add(response_time)
+    
+    @property
+    def avg_response_time(self) -> float:
+        return self.rt_sum / self.rt_count if self.rt_count else 0
+    
+    def _release_slot(self):
+        if self.slots is not None:
+            self.slots.release()
+    
+    @property
+    def messages_sent(self) -> int:
+        return int(self.counters[SENT, self.index])
+    
+    @property
+    def messages_received(self) -> int:
+        return int(self.counters[RECEIVED, self.index])
+    
+    @property
+    def in_flight(self) -> int:
+        """Messages queued or sent but not yet answered"""
+        return self.out_queue.qsize() + len(self.pending)
     
     async def listen_for_messages(self):
-        """Listen for incoming messages"""
+        """Listen for incoming messages, matching replies to sends to measure response times"""
         try:
             while self.connected:
-                message = await self.websocket.recv()
-                # Just count received messages
-                self.messages_received += 1
+                await self.websocket.recv()
+                self.counters[RECEIVED, self.index] += 1
+                # The server answers each client's messages in order
+                if self.pending:
+                    self._record_response_time(self.loop.time() - self.pending.popleft())
+                    self._release_slot()
         except Exception as e:
             if self.connected:
                 self.errors.append(f"Listen error: {e}")
+            # Replies to these will never arrive
+            while self.pending:
+                self.pending.popleft()
+                self._release_slot()
 
 class LoadTester:
     def __init__(self, server_url: str, num_clients: int, test_duration: int):
@@ -96,6 +204,9 @@ class LoadTester:
         self.num_clients = num_clients
         self.test_duration = test_duration
         self.clients: List[LoadTestClient] = []
+        # Sent/received counts for every client, summed in one pass for the report
+        self.counters = np.zeros((2, num_clients), dtype=np.int64)
+        self.samples = ResponseTimeSamples()
         self.test_messages = [
             "Hello! How are you?",
             "I want to start working out",
@@ -108,13 +219,16 @@ class LoadTester:
             "Can you create a meal plan?",
             "What exercises build muscle?"
         ]
+        # Serialized and UTF-8 encoded once; the send loop only queues these
+        self.test_frames = [_dump_bytes({"type": "message", "message": message}) for message in self.test_messages]
         
     async def setup_clients(self):
         """Create and connect all test clients"""
         print(f"🔗 Connecting {self.num_clients} clients...")
         
+        connect_kwargs = self._shared_connect_kwargs()
         for i in range(self.num_clients):
-            client = LoadTestClient(f"load-test-{i}", self.server_url)
+            client = LoadTestClient(f"load-test-{i}", self.server_url, connect_kwargs, self.counters, i, self.samples)
             self.clients.append(client)
         
         # Connect all clients concurrently
@@ -122,10 +236,20 @@ class LoadTester:
         results = await asyncio.gather(*connection_tasks, return_exceptions=True)
         
         connected_count = sum(1 for result in results if result is True)
+        for client in self.clients:
+            client.start_sender()
         print(f"✅ {connected_count}/{self.num_clients} clients connected")
         
         return connected_count
     
+    def _shared_connect_kwargs(self) -> Dict[str, Any]:
+        """Share one TLS context across every client connection"""
+        # Host resolution is left to each connect so asyncio can fall back across all resolved addresses
+        kwargs: Dict[str, Any] = {}
+        if urlsplit(self.server_url).scheme == "wss":
+            kwargs["ssl"] = ssl.create_default_context()
+        return kwargs
+    
     async def run_load_test(self):
         """Run the main load test"""
         print(f"🚀 Starting load test for {self.test_duration} seconds...")
@@ -136,32 +260,43 @@ class LoadTester:
             for client in self.clients if client.connected
         ]
         
-        # Run test for specified duration
-        start_time = time.time()
-        message_tasks = []
-        
-        while time.time() - start_time < self.test_duration:
-            # Send messages from random clients
+        # Listeners are always cancelled and awaited, even if the run is interrupted
+        try:
+            # Limit concurrent messages
+            slots = asyncio.Semaphore(50)
             for client in self.clients:
-                if client.connected and len(message_tasks) < 50:  # Limit concurrent messages
-                    message = self.test_messages[int(time.time()) % len(self.test_messages)]
-                    task = asyncio.create_task(client.send_message(message))
-                    message_tasks.append(task)
+                client.slots = slots
             
-            # Clean up completed tasks
-            if len(message_tasks) >= 30:
-                done_tasks = [task for task in message_tasks if task.done()]
-                for task in done_tasks:
-                    message_tasks.remove(task)
+            # Run test for specified duration
+            loop = asyncio.get_running_loop()
+            start_time = loop.time()
+            frame_second = None
             
-            await asyncio.sleep(0.1)  # Small delay between batches
-        
-        # Wait for remaining message tasks
-        await asyncio.gather(*message_tasks, return_exceptions=True)
-        
-        # Stop listeners
-        for task in listen_tasks:
-            task.cancel()
+            while (now := loop.time()) - start_time < self.test_duration:
+                # The test message rotates once a second; pick it only when the second changes
+                second = int(now)
+                if second != frame_second:
+                    frame_second = second
+                    frame = self.test_frames[second % len(self.test_frames)]
+                
+                # Queue a message on each client while slots are free
+                for client in self.clients:
+                    if slots.locked():
+                        break
+                    if client.connected and not client.out_queue.full():
+                        await slots.acquire()  # Never waits: a slot is free
+                        client.out_queue.put_nowait(frame)
+                
+                await asyncio.sleep(0.1)  # Small delay between batches
+            
+            # Give outstanding messages up to 30s to be answered
+            drain_deadline = time.time() + 30
+            while any(client.in_flight for client in self.clients if client.connected) and time.time() < drain_deadline:
+                await asyncio.sleep(0.1)
+        finally:
+            for task in listen_tasks:
+                task.cancel()
+            await asyncio.gather(*listen_tasks, return_exceptions=True)
         
         print("⏹️ Load test completed")
     
@@ -174,20 +309,22 @@ class LoadTester:
     
     def generate_report(self) -> Dict[str, Any]:
         """Generate test results report"""
-        total_sent = sum(client.messages_sent for client in self.clients)
-        total_received = sum(client.messages_received for client in self.clients)
+        total_sent, total_received = (int(total) for total in self.counters.sum(axis=1))
         total_errors = sum(len(client.errors) for client in self.clients)
         
-        all_response_times = []
-        for client in self.clients:
-            all_response_times.extend(client.response_times)
+        # Mean, min and max are exact from the running totals; median and p95 come from the shared samples
+        # (frombuffer views the array('d') memory without copying)
+        timed = [client for client in self.clients if client.rt_count]
+        all_response_times = np.frombuffer(self.samples.values, dtype=np.float64)
         
-        if all_response_times:
-            avg_response_time = statistics.mean(all_response_times)
-            median_response_time = statistics.median(all_response_times)
-            min_response_time = min(all_response_times)
-            max_response_time = max(all_response_times)
-            p95_response_time = sorted(all_response_times)[int(len(all_response_times) * 0.95)]
+        if timed:
+            avg_response_time = sum(client.rt_sum for client in timed) / sum(client.rt_count for client in timed)
+            median_response_time = float(np.median(all_response_times))
+            min_response_time = min(client.rt_min for client in timed)
+            max_response_time = max(client.rt_max for client in timed)
+            # Linear-time selection instead of a full sort
+            p95_index = int(all_response_times.size * 0.95)
+            p95_response_time = float(np.partition(all_response_times, p95_index)[p95_index])
         else:
             avg_response_time = median_response_time = min_response_time = max_response_time = p95_response_time = 0
         
@@ -220,7 +357,7 @@ class LoadTester:
                     "messages_sent": client.messages_sent,
                     "messages_received": client.messages_received,
                     "errors": len(client.errors),
-                    "avg_response_time": statistics.mean(client.response_times) if client.response_times else 0
+                    "avg_response_time": client.avg_response_time
                 }
                 for client in self.clients
             ]
@@ -312,4 +449,12 @@ async def main():
         await tester.cleanup_clients()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Run on uvloop when it is installed (it has no Windows build)
+    run = asyncio.run
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            run = uvloop.run
+        except ImportError:
+            pass
+    run(main())
\ No newline at end of file
@@ -168,7 +168,7 @@ start_server() {
     echo ""
     
     cd app
-    python -m uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+    python -m uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools --reload
 }
 
 # Parse command line arguments
@@ -0,0 +1,86 @@
+import os
+import unittest
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["INTENT_CACHE_ENABLED"] = "false"
+
+from langsmith.wrappers import wrap_openai
+from app.llm_service import LLMService, LLMClientPool, _STREAMED_INTENT, _INTENT_RESPONSE_FORMAT
+
+class FakeStream:
+    """Stands in for openai.AsyncStream: yields content deltas and owns an HTTP response"""
+    
+    def __init__(self, text: str, chunk_size: int = 4):
+        self.parts = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        self.read = 0
+        self.response = SimpleNamespace(aclose=self._close_response)
+        self.response_closed = False
+    
+    async def _close_response(self):
+        self.response_closed = True
+    
+    def __aiter__(self):
+        return self._chunks()
+    
+    async def _chunks(self):
+        for part in self.parts:
+            self.read += 1
+            delta = SimpleNamespace(content=part)
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta)])
+
+class FakeClient:
+    """Minimal AsyncOpenAI lookalike that wrap_openai can patch"""
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.streams = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.completions = SimpleNamespace(create=self._create)
+    
+    async def _create(self, **kwargs):
+        stream = FakeStream(self.text)
+        self.streams.append(stream)
+        return stream
+
+INTENT_JSON = '{"agent":"helios","confidence":0.85,"reasoning":"' + "long reasoning " * 20 + '"}'
+
+class StreamIntentsTest(unittest.IsolatedAsyncioTestCase):
+    """_stream_intents against a LangSmith-wrapped client, whose streams are async generators"""
+    
+    async def asyncSetUp(self):
+        self.service = LLMService(enable_langsmith=False)
+        self.service.cache_enabled = False
+        self.client = FakeClient(INTENT_JSON)
+        self.service.pool = LLMClientPool([wrap_openai(self.client)])
+    
+    async def asyncTearDown(self):
+        await self.service.close()
+    
+    async def _stream(self, expected: int):
+        found = {}
+        text = await self.service._stream_intents(
+            "User message: \"plan my week\"", "system", 200, _INTENT_RESPONSE_FORMAT,
+            _STREAMED_INTENT, expected, found.__setitem__
+        )
+        return text, found
+    
+    async def test_runs_to_completion(self):
+        text, found = await self._stream(expected=2)
+        
+        self.assertEqual(text, INTENT_JSON)
+        self.assertEqual(found[0].agent, "helios")
+        self.assertAlmostEqual(found[0].confidence, 0.85)
+        stream = self.client.streams[0]
+        self.assertEqual(stream.read, len(stream.parts))
+    
+    async def test_stops_after_expected_intents(self):
+        text, found = await self._stream(expected=1)
+        
+        self.assertEqual(found[0].agent, "helios")
+        self.assertTrue(INTENT_JSON.startswith(text))
+        stream = self.client.streams[0]
+        self.assertLess(stream.read, len(stream.parts))
+
+if __name__ == "__main__":
+    unittest.main()